@@ -0,0 +1,164 @@
+# Streaming exports of the user roster, lottery tickets and prize winners as CSV or NDJSON, optionally gzipped.
+# Rows are read EXPORT_BATCH_SIZE at a time by keyset (after the id of the last row of the previous batch, see
+# pagination), each batch in a short transaction of its own, and archived rounds a slice of their memory-mapped
+# columns at a time. Each batch is encoded and sent before the next one is read, so memory stays flat, the first
+# bytes are sent straight away and a slow client never holds a read transaction (and its SHARED lock on SQLite)
+# open. Batches are read as of different moments, rows written during an export may or may not be in it.
+# IMPORTS
+import csv
+import io
+import json
+import zlib
+
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import select
+
+from extensions import db
+from models import User, Draw
+
+# CONFIG
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# CSV cells starting with one of these are read as formulas by spreadsheets, they are sent prefixed with '
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+# columns of each export
+EXPORTS = {
+    'users': ('id', 'email', 'firstname', 'lastname', 'phone', 'role'),
+    'tickets': ('draw_id', 'user_id', 'lottery_round', 'been_played', 'match_count', 'archived'),
+    'winners': ('draw_id', 'user_id', 'email', 'lottery_round', 'match_count', 'archived'),
+}
+
+
+# FUNCTIONS
+# batches of the rows of a select in id order, each read by keyset in a transaction that ends before the batch is
+# yielded
+def keyset_batches(query, id_column, batch_size):
+    last_id = None
+    while True:
+        page = query if last_id is None else query.where(id_column > last_id)
+        batch = db.session.execute(page.order_by(id_column).limit(batch_size)).all()
+        db.session.rollback()
+
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+        last_id = batch[-1].id
+
+
+# batches of (id, email, firstname, lastname, phone, role) rows of every user
+def user_rows(batch_size):
+    yield from keyset_batches(select(User.id, User.email, User.firstname, User.lastname, User.phone, User.role),
+                              User.id, batch_size)
+
+
+# batches of the tickets of lottery_round (every round if None), settled tickets matching at least min_matches
+# numbers if given. Draws still in the draws table come first, then the archived ones.
+def ticket_rows(batch_size, lottery_round=None, min_matches=None):
+    query = select(Draw.id, Draw.user_id, Draw.lottery_round, Draw.been_played, Draw.match_count) \
+        .where(Draw.master_draw == False)
+    if lottery_round is not None:
+        query = query.where(Draw.lottery_round == lottery_round)
+    if min_matches is not None:
+        query = query.where(Draw.match_count >= min_matches)
+
+    for batch in keyset_batches(query, Draw.id, batch_size):
+        yield [(row.id, row.user_id, row.lottery_round, row.been_played, row.match_count, False) for row in batch]
+
+    yield from archived_ticket_rows(batch_size, lottery_round, min_matches)
+
+
+def archived_ticket_rows(batch_size, lottery_round, min_matches):
+    from lottery.archive import round_archive
+
+    archive = round_archive(current_app)
+    for record in archive.index():
+        if lottery_round is not None and record['lottery_round'] != lottery_round:
+            continue
+
+        columns = archive.columns(record)
+        for first in range(0, int(record['rows']), batch_size):
+            draw_ids = columns['draw_id'][first:first + batch_size]
+            user_ids = columns['user_id'][first:first + batch_size]
+            match_counts = columns['match_count'][first:first + batch_size]
+
+            if min_matches is not None:
+                winning = match_counts >= min_matches
+                draw_ids, user_ids, match_counts = draw_ids[winning], user_ids[winning], match_counts[winning]
+
+            if len(draw_ids):
+                yield [(draw_id, user_id, int(record['lottery_round']), True, match_count, True)
+                       for draw_id, user_id, match_count in zip(draw_ids.tolist(), user_ids.tolist(),
+                                                                match_counts.tolist())]
+
+
+# batches of the prize winning tickets of lottery_round (every round if None) with the email of their user, looked
+# up for each batch
+def winner_rows(batch_size, lottery_round=None):
+    from lottery.scoring import PRIZE_TIERS
+
+    for batch in ticket_rows(batch_size, lottery_round, PRIZE_TIERS[0]):
+        user_ids = {row[1] for row in batch}
+        emails = dict(db.session.execute(select(User.id, User.email).where(User.id.in_(user_ids))).all())
+        db.session.rollback()
+        yield [(draw_id, user_id, emails.get(user_id), ticket_round, match_count, archived)
+               for draw_id, user_id, ticket_round, _, match_count, archived in batch]
+
+
+# a CSV cell, text a spreadsheet would read as a formula is prefixed with ' so it is shown as text
+def csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+# encode batches of rows, as CSV under a header row or as one JSON object per line
+def encode(fields, batches, export_format):
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # the header is sent before the first batch is read
+        writer.writerow(fields)
+        yield buffer.getvalue().encode('utf-8')
+        for batch in batches:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows([csv_cell(value) for value in row] for row in batch)
+            yield buffer.getvalue().encode('utf-8')
+    else:
+        for batch in batches:
+            yield ''.join(json.dumps(dict(zip(fields, row))) + '\n' for row in batch).encode('utf-8')
+
+
+# gzip a stream of chunks, flushing after each chunk so the client receives every batch as soon as it is encoded
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+# streamed response of an export
+def stream_export(export, export_format, lottery_round=None, gzip=False):
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+
+    if export == 'users':
+        batches = user_rows(batch_size)
+    elif export == 'tickets':
+        batches = ticket_rows(batch_size, lottery_round)
+    else:
+        batches = winner_rows(batch_size, lottery_round)
+
+    chunks = encode(EXPORTS[export], batches, export_format)
+    filename = '%s%s.%s' % (export, '' if lottery_round is None else '_round_%d' % lottery_round, export_format)
+    mimetype = FORMATS[export_format]
+
+    if gzip:
+        chunks = gzipped(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': 'attachment; filename=%s' % filename,
+                             'Cache-Control': 'no-store'})
@@ -0,0 +1,151 @@
+# Runs long admin tasks as background jobs on an in-process thread, tracked in the jobs table
+# IMPORTS
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+
+from admin.settlement import start_settlement, settle_batches, round_results
+from extensions import db
+from lottery.archive import archivable_draws, archive_played_rounds, round_archive
+from models import Draw, Job, Settlement
+
+# CONFIG
+# jobs run one at a time so two settlements or archives never compete for the database write lock
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='jobs')
+
+
+# FUNCTIONS
+# start settling the round of the current winning draw and queue a job to settle its draws. Returns None if there
+# are no unplayed user draws. A round already being settled returns its job instead, unless the job stopped
+# reporting progress (e.g. the worker running it died), in which case a new job resumes the settlement from its
+# last checkpoint.
+def submit_settlement(winning_draw, draw_key):
+    settlement = start_settlement(winning_draw)
+
+    # if no unplayed user draws exist
+    if settlement is None:
+        return None
+
+    job = active_job('run_lottery', winning_draw.lottery_round)
+    if job:
+        return job
+
+    job = Job(kind='run_lottery', lottery_round=winning_draw.lottery_round)
+    db.session.add(job)
+    db.session.commit()
+
+    executor.submit(run_settlement, current_app._get_current_object(), job.id, winning_draw.id, draw_key)
+    return job
+
+
+# queue a job moving the played draws of every settled round to the archive. The job works on every round, so its
+# lottery round is 0. An archive job already queued or running is returned instead.
+def submit_archive():
+    job = active_job('archive', 0)
+    if job:
+        return job
+
+    job = Job(kind='archive', lottery_round=0)
+    db.session.add(job)
+    db.session.commit()
+
+    executor.submit(run_archive, current_app._get_current_object(), job.id)
+    return job
+
+
+# the queued or running job of a kind working on a lottery round, or None. A job that stopped reporting progress
+# (e.g. the worker running it died) is updated as failed, so a new job can take over.
+def active_job(kind, lottery_round):
+    job = Job.query.filter(Job.kind == kind, Job.lottery_round == lottery_round,
+                           Job.status.in_(['queued', 'running'])) \
+        .order_by(Job.id.desc()) \
+        .first()
+
+    stale_before = datetime.now() - timedelta(seconds=current_app.config['JOB_TIMEOUT'])
+    if job and (job.updated_on or job.created_on) > stale_before:
+        return job
+
+    if job:
+        job.status = 'failed'
+        job.error = 'Job stopped reporting progress'
+        job.finished_on = datetime.now()
+        db.session.commit()
+
+    return None
+
+
+# settle a round in the background, recording progress on the job after each batch
+def run_settlement(app, job_id, winning_draw_id, draw_key):
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+
+        try:
+            winning_draw = db.session.get(Draw, winning_draw_id)
+            settlement = Settlement.query.filter_by(lottery_round=winning_draw.lottery_round).first()
+
+            # draws left to settle (the settlement may be resuming from a checkpoint)
+            job.draws_total = settlement.draws_settled + db.session.query(func.count(Draw.id)) \
+                .filter(Draw.master_draw == False, Draw.been_played == False,
+                        Draw.id > settlement.checkpoint, Draw.id <= settlement.last_draw_id) \
+                .scalar()
+            job.draws_processed = settlement.draws_settled
+            job.winners = sum(settlement.tier_counts().values())
+            job.status = 'running'
+            job.started_on = job.updated_on = datetime.now()
+            db.session.commit()
+
+            for settlement in settle_batches(settlement, winning_draw, draw_key):
+                job.draws_processed = settlement.draws_settled
+                job.winners = sum(settlement.tier_counts().values())
+                job.updated_on = datetime.now()
+                db.session.commit()
+
+            results, tier_counts = round_results(settlement, winning_draw)
+            job.result = json.dumps({'winners': [{'lottery_round': lottery_round, 'user_id': user_id, 'email': email}
+                                                 for lottery_round, _, user_id, email in results],
+                                     'tier_counts': tier_counts})
+            job.status = 'completed'
+            job.finished_on = job.updated_on = datetime.now()
+            db.session.commit()
+
+        except Exception as error:
+            logging.exception('Background job %s failed', job_id)
+            db.session.rollback()
+            job.status = 'failed'
+            job.error = str(error)
+            job.finished_on = datetime.now()
+            db.session.commit()
+
+
+# archive the played draws of the settled rounds in the background, recording progress on the job after each round
+def run_archive(app, job_id):
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+
+        try:
+            job.draws_total = archivable_draws()
+            job.status = 'running'
+            job.started_on = job.updated_on = datetime.now()
+            db.session.commit()
+
+            for archived in archive_played_rounds(round_archive(app)):
+                job.draws_processed += archived
+                job.updated_on = datetime.now()
+                db.session.commit()
+
+            job.result = json.dumps({'archived': job.draws_processed})
+            job.status = 'completed'
+            job.finished_on = job.updated_on = datetime.now()
+            db.session.commit()
+
+        except Exception as error:
+            logging.exception('Background job %s failed', job_id)
+            db.session.rollback()
+            job.status = 'failed'
+            job.error = str(error)
+            job.finished_on = datetime.now()
+            db.session.commit()
@@ -0,0 +1,168 @@
+# IMPORTS
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+from flask import current_app
+from sqlalchemy import bindparam, func, update
+
+from extensions import db
+from lottery import scoring
+from lottery.draws import DRAW_SIZE
+from models import User, Draw, Settlement, decrypt_mask
+
+
+# FUNCTIONS
+# settle a lottery round against the current winning draw. Draws are settled in batches of SETTLEMENT_BATCH_SIZE
+# draws, each batch is committed together with a checkpoint so an interrupted settlement resumes after the last
+# settled draw. Returns None if there are no unplayed user draws, otherwise the list of jackpot winners as
+# (lottery round, draw numbers, user id, user email) tuples and the number of draws in each prize tier.
+def settle_round(winning_draw, draw_key):
+    settlement = start_settlement(winning_draw)
+
+    # if no unplayed user draws exist
+    if settlement is None:
+        return None
+
+    for _ in settle_batches(settlement, winning_draw, draw_key):
+        pass
+
+    return round_results(settlement, winning_draw)
+
+
+# get the checkpoint of an interrupted settlement of the round or start a new one.
+# Returns None if there are no unplayed user draws.
+def start_settlement(winning_draw):
+    settlement = Settlement.query.filter_by(lottery_round=winning_draw.lottery_round).first()
+
+    if settlement is None:
+        # only settle draws submitted so far, draws submitted while settling wait for the next round
+        last_draw_id = last_unplayed_draw_query().scalar()
+
+        if last_draw_id is None:
+            return None
+
+        settlement = Settlement(lottery_round=winning_draw.lottery_round, last_draw_id=last_draw_id)
+        db.session.add(settlement)
+        db.session.commit()
+
+    return settlement
+
+
+# settle the draws of the round batch by batch from the last checkpoint, yielding the settlement after each batch
+# is committed. The winning draw is updated as played once every draw is settled.
+def settle_batches(settlement, winning_draw, draw_key):
+    winning_mask = decrypt_mask(winning_draw.numbers, draw_key)
+    batch_size = current_app.config['SETTLEMENT_BATCH_SIZE']
+    workers = current_app.config['SETTLEMENT_WORKERS']
+    settlement.winning_mask = winning_mask
+
+    # the workers are spawned rather than forked, settlement runs on a job thread and forking a threaded process can
+    # copy locks held by other threads into the workers
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) \
+            if workers > 1 else nullcontext() as executor:
+        while settlement.checkpoint < settlement.last_draw_id:
+            # the last draw of the next batch, found from the checkpoint so no draw is skipped or settled twice
+            batch_last_id = batch_last_id_query(settlement, batch_size).scalar()
+
+            settle_batch(settlement, winning_draw, winning_mask, batch_last_id or settlement.last_draw_id, executor)
+            yield settlement
+
+    # number of users with draws in the round, kept with the round statistics
+    settlement.players = players_query(winning_draw.lottery_round).scalar()
+
+    # update current winning draw as played
+    winning_draw.been_played = True
+    settlement.completed = True
+    db.session.add(winning_draw)
+    db.session.commit()
+
+
+# settle the unplayed user draws after the checkpoint up to batch_last_id and commit them with a new checkpoint
+def settle_batch(settlement, winning_draw, winning_mask, batch_last_id, executor):
+    batch = batch_query(settlement, batch_last_id)
+
+    # score every draw of the batch for the prize tiers and count the numbers drawn
+    if executor is not None:
+        winner_ids, winner_counts, number_counts = scoring.score_parallel(
+            executor, db.engine.url.render_as_string(hide_password=False), winning_mask,
+            settlement.checkpoint + 1, batch_last_id, current_app.config['SETTLEMENT_CHUNK_SIZE'])
+    else:
+        winner_ids, winner_counts, number_counts = score_serial(winning_mask, settlement.checkpoint + 1, batch_last_id)
+
+    # write back the match count of the draws winning a prize, the draws matching every number are updated as
+    # matching the master draw from the same count (this will be used to highlight winning draws in the user's
+    # lottery page)
+    if len(winner_ids):
+        db.session.execute(update(Draw.__table__)
+                           .where(Draw.__table__.c.id == bindparam('draw_id'))
+                           .values(match_count=bindparam('matches'), matches_master=bindparam('jackpot')),
+                           [{'draw_id': int(draw_id), 'matches': int(match_count),
+                             'jackpot': int(match_count) == DRAW_SIZE}
+                            for draw_id, match_count in zip(winner_ids, winner_counts)])
+
+    # update all draws as played in the current lottery round
+    draws_settled = batch.update({Draw.been_played: True, Draw.lottery_round: winning_draw.lottery_round},
+                                 synchronize_session=False)
+
+    # commit the batch together with its checkpoint
+    settlement.checkpoint = batch_last_id
+    settlement.draws_settled += draws_settled
+    settlement.add_tier_counts(scoring.tier_counts(winner_counts))
+    settlement.add_number_counts(number_counts)
+    db.session.add(settlement)
+    db.session.commit()
+
+
+# score the unplayed user draws with ids from first_id to last_id in this process, as one chunk scored the way the
+# workers score theirs. Returns the ids and match counts of the draws winning a prize and the number of draws
+# containing each number.
+def score_serial(winning_mask, first_id, last_id):
+    return scoring.score_chunk(db.engine.url.render_as_string(hide_password=False), winning_mask, first_id, last_id)
+
+
+# jackpot winners of a settled round, together with the email of their owners, and the number of draws in each
+# prize tier
+def round_results(settlement, winning_draw):
+    winners = round_winners_query(winning_draw.lottery_round).all()
+
+    results = [(winning_draw.lottery_round, row.numbers, row.user_id, row.email) for row in winners]
+    return results, settlement.tier_counts()
+
+
+# QUERIES
+# built here so tests/test_query_plans.py checks the same queries as the settlement runs
+# the last unplayed user draw, the last draw of a new settlement
+def last_unplayed_draw_query():
+    return db.session.query(func.max(Draw.id)) \
+        .filter(Draw.master_draw == False, Draw.been_played == False)
+
+
+# the batch_size-th unplayed user draw after the checkpoint of a settlement
+def batch_last_id_query(settlement, batch_size):
+    return db.session.query(Draw.id) \
+        .filter(Draw.master_draw == False, Draw.been_played == False,
+                Draw.id > settlement.checkpoint, Draw.id <= settlement.last_draw_id) \
+        .order_by(Draw.id) \
+        .offset(batch_size - 1) \
+        .limit(1)
+
+
+# the unplayed user draws after the checkpoint of a settlement up to batch_last_id
+def batch_query(settlement, batch_last_id):
+    return Draw.query.filter(Draw.master_draw == False, Draw.been_played == False,
+                             Draw.id > settlement.checkpoint, Draw.id <= batch_last_id)
+
+
+# number of users with draws in a settled round
+def players_query(lottery_round):
+    return db.session.query(func.count(func.distinct(Draw.user_id))) \
+        .filter(Draw.master_draw == False, Draw.been_played == True, Draw.lottery_round == lottery_round)
+
+
+# jackpot winning draws of a settled round with the email of their owners
+def round_winners_query(lottery_round):
+    return db.session.query(Draw.numbers, Draw.user_id, User.email) \
+        .outerjoin(User, User.id == Draw.user_id) \
+        .filter(Draw.master_draw == False, Draw.lottery_round == lottery_round, Draw.matches_master == True) \
+        .order_by(Draw.id)
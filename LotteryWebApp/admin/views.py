@@ -1,9 +1,18 @@
 # IMPORTS
 from copy import deepcopy
-from flask import Blueprint, render_template, request, flash
+from flask import Blueprint, render_template, request, flash, abort, jsonify, current_app, make_response
 from flask_login import current_user, login_required
-from app import db, requires_roles
-from models import User, Draw
+import metrics
+import security_log
+from app import requires_roles
+from extensions import db
+from lottery.draws import DRAW_SIZE, parse_draw, draw_string
+from models import User, Draw, Job, Settlement
+from page_cache import render_cached
+from pagination import keyset_page, wants_json
+
+# settlement, the archive and statistics use numpy and are imported by the views using them, so workers start
+# without loading numpy until a round is run or viewed
 
 # CONFIG
 admin_blueprint = Blueprint('admin', __name__, template_folder='templates')
@@ -15,15 +24,26 @@ admin_blueprint = Blueprint('admin', __name__, template_folder='templates')
 @login_required
 @requires_roles('admin')
 def admin():
-    return render_template('admin.html', name=current_user.firstname)
+    return render_cached('admin.html', tables=('users',), name=current_user.firstname)
 
 
-# view all registered users
+# view all registered users, a page at a time
 @admin_blueprint.route('/view_all_users', methods=['POST'])
 @login_required
+@requires_roles('admin')
 def view_all_users():
-    return render_template('admin.html', name=current_user.firstname,
-                           current_users=User.query.filter_by(role='user').all())
+    current_users, next_cursor = keyset_page(users_query(), User.id)
+
+    if wants_json():
+        return jsonify(users=[{'id': user.id,
+                               'role': user.role,
+                               'email': user.email,
+                               'firstname': user.firstname,
+                               'lastname': user.lastname} for user in current_users],
+                       next_cursor=next_cursor)
+
+    return render_template('admin.html', name=current_user.firstname, current_users=current_users,
+                           next_cursor=next_cursor)
 
 
 # create a new winning draw
@@ -31,12 +51,28 @@ def view_all_users():
 @login_required
 @requires_roles('admin')
 def create_winning_draw():
+    # get new winning draw entered in form, checked before the current winning draw is replaced
+    try:
+        numbers = parse_draw([request.form.get('no' + str(i + 1)) for i in range(DRAW_SIZE)])
+    except ValueError as error:
+        flash(str(error))
+        return admin()
+
+    submitted_draw = draw_string(numbers)
+
     # get current winning draw
-    current_winning_draw = Draw.query.filter_by(master_draw=True).first()
+    current_winning_draw = winning_draw_query().first()
     lottery_round = 1
 
     # if a current winning draw exists
     if current_winning_draw:
+        # the draw of a round being settled is needed until its settlement completes, an interrupted settlement is
+        # finished by running the lottery again
+        if settlement_running(current_winning_draw.lottery_round):
+            flash('Lottery round %s is still being played. Add the new winning draw once it has finished.'
+                  % current_winning_draw.lottery_round)
+            return admin()
+
         # update lottery round by 1
         lottery_round = current_winning_draw.lottery_round + 1
 
@@ -44,24 +80,6 @@ def create_winning_draw():
         db.session.delete(current_winning_draw)
         db.session.commit()
 
-    # get new winning draw entered in form
-    submitted_draw = ''
-    for i in range(6):
-
-        try:
-            num = int(request.form.get('no' + str(i + 1)))
-        except ValueError:
-            flash('The Draw should be an integer')
-            return admin()
-
-        if num < 1 or num > 60:
-            flash('Invalid draw.')
-            return admin()
-
-        submitted_draw += str(num) + ' '
-    # remove any surrounding whitespace
-    submitted_draw.strip()
-
     # create a new draw object with the form data.
     new_winning_draw = Draw(user_id=0, numbers=submitted_draw, master_draw=True, lottery_round=lottery_round,
                             draw_key=current_user.draw_key)
@@ -75,13 +93,21 @@ def create_winning_draw():
     return admin()
 
 
+# True if the settlement of the lottery round has not completed or a job settling it is queued or running
+def settlement_running(lottery_round):
+    settlement = Settlement.query.filter_by(lottery_round=lottery_round, completed=False).first()
+    job = Job.query.filter(Job.kind == 'run_lottery', Job.lottery_round == lottery_round,
+                           Job.status.in_(['queued', 'running'])).first()
+    return settlement is not None or job is not None
+
+
 # view current winning draw
 @admin_blueprint.route('/view_winning_draw', methods=['POST'])
 @login_required
 @requires_roles('admin')
 def view_winning_draw():
     # get winning draw from DB
-    current_winning_draw = Draw.query.filter_by(master_draw=True, been_played=False).first()
+    current_winning_draw = unplayed_winning_draw_query().first()
     current_winning_draw_two = deepcopy(current_winning_draw)
 
     # if a winning draw exists
@@ -95,75 +121,181 @@ def view_winning_draw():
     return admin()
 
 
-# view lottery results and winners
+# run the lottery, the draws are settled by a background job
 @admin_blueprint.route('/run_lottery', methods=['POST'])
 @login_required
 @requires_roles('admin')
 def run_lottery():
     # get current unplayed winning draw
-    current_winning_draw = Draw.query.filter_by(master_draw=True, been_played=False).first()
+    current_winning_draw = unplayed_winning_draw_query().first()
 
     # if current unplayed winning draw exists
     if current_winning_draw:
+        from admin.jobs import submit_settlement
 
-        # get all unplayed user draws
-        user_draws = Draw.query.filter_by(master_draw=False, been_played=False).all()
-        results = []
+        # queue a job to settle all unplayed user draws against the current winning draw
+        job = submit_settlement(current_winning_draw, current_user.draw_key)
 
         # if at least one unplayed user draw exists
-        if user_draws:
+        if job:
+            flash("Lottery round %s is being played (job %s)." % (job.lottery_round, job.id))
+            return render_template('admin.html', job=job, name=current_user.firstname)
 
-            # update current winning draw as played
-            current_winning_draw.been_played = True
-            db.session.add(current_winning_draw)
-            db.session.commit()
+        flash("No user draws entered.")
+        return admin()
 
-            # for each unplayed user draw
-            for draw in user_draws:
+    # if current unplayed winning draw does not exist
+    flash("Current winning draw expired. Add new winning draw for next round.")
+    return admin()
 
-                # get the owning user (instance/object)
-                user = User.query.filter_by(id=draw.user_id).first()
 
-                # if user draw matches current unplayed winning draw
-                if draw.numbers == current_winning_draw.numbers:
-                    # add details of winner to list of results
-                    results.append((current_winning_draw.lottery_round, draw.numbers, draw.user_id, user.email))
+# view progress and results of a background job
+@admin_blueprint.route('/admin/jobs/<int:job_id>')
+@login_required
+@requires_roles('admin')
+def job_progress(job_id):
+    job = db.session.get(Job, job_id)
 
-                    # update draw as a winning draw (this will be used to highlight winning draws in the user's
-                    # lottery page)
-                    draw.matches_master = True
+    if not job:
+        abort(404)
 
-                # update draw as played
-                draw.been_played = True
+    return jsonify(job.progress())
 
-                # update draw with current lottery round
-                draw.lottery_round = current_winning_draw.lottery_round
 
-                # commit draw changes to DB
-                db.session.add(draw)
-                db.session.commit()
+# view the results of the archived lottery rounds, newest round first
+@admin_blueprint.route('/archived_rounds', methods=['POST'])
+@login_required
+@requires_roles('admin')
+def archived_rounds():
+    from lottery.archive import round_archive
 
-            # if no winners
-            if len(results) == 0:
-                flash("No winners.")
+    rounds = round_archive(current_app).rounds()
 
-            return render_template('admin.html', results=results, name=current_user.firstname)
+    if wants_json():
+        return jsonify(rounds=rounds)
 
-        flash("No user draws entered.")
+    if not rounds:
+        flash("No archived rounds.")
         return admin()
 
-    # if current unplayed winning draw does not exist
-    flash("Current winning draw expired. Add new winning draw for next round.")
-    return admin()
+    return render_template('admin.html', archived_rounds=rounds, name=current_user.firstname)
+
 
+# stream an export of the users, tickets or prize winners (export) as csv or ndjson (format), gzipped if gzip is 1.
+# Tickets and winners can be limited to one lottery round (round).
+@admin_blueprint.route('/admin/export/<export>')
+@login_required
+@requires_roles('admin')
+def export_rows(export):
+    from admin.exports import EXPORTS, FORMATS, stream_export
 
-# view last 10 log entries
+    export_format = request.args.get('format', 'csv')
+    if export not in EXPORTS:
+        abort(404)
+    if export_format not in FORMATS:
+        abort(400, 'Export format must be csv or ndjson')
+
+    return stream_export(export, export_format, request.args.get('round', type=int), request.args.get('gzip') == '1')
+
+
+# view participation, winners and number frequencies of the settled rounds from first_round to last_round
+@admin_blueprint.route('/statistics', methods=['GET', 'POST'])
+@login_required
+@requires_roles('admin')
+def statistics():
+    first_round = request.values.get('first_round', type=int)
+    last_round = request.values.get('last_round', type=int)
+
+    from lottery.statistics import round_statistics
+
+    results = round_statistics(first_round, last_round)
+
+    if wants_json():
+        return jsonify(results)
+
+    return render_template('statistics.html', statistics=results, first_round=first_round, last_round=last_round,
+                           most_drawn=max([row['count'] for row in results['numbers']] + [1]),
+                           name=current_user.firstname)
+
+
+# view last 10 log entries, older entries can be paged back and filtered by event type using the log index
 @admin_blueprint.route('/logs', methods=['POST'])
 @login_required
 @requires_roles('admin')
 def logs():
-    with open("lottery.log", "r") as f:
-        content = f.read().splitlines()[-10:]
+    event = request.form.get('event') or None
+    skip = request.form.get('skip', 0, type=int)
+
+    if event not in security_log.EVENT_TYPES:
+        event = None
+
+    log_file = current_app.config['LOG_FILE']
+    log_index = current_app.config['LOG_INDEX']
+
+    # the newest entries are read from the end of the log, older or filtered entries need the index
+    if (event or skip) and log_index:
+        content, next_skip = security_log.history(log_file, current_app.config['LOG_BACKUP_COUNT'], 10, skip, event)
+    else:
+        content = security_log.tail(log_file, 10)
         content.reverse()
+        next_skip = 10 if log_index and len(content) == 10 else None
+
+    return render_template('admin.html', logs=content, next_skip=next_skip, event=event,
+                           event_types=security_log.EVENT_TYPES, name=current_user.firstname)
+
+
+# view the request metrics of the last METRICS_WINDOW seconds, the cache counters and the profiles of sampled
+# requests. Posting profile_rate changes the share of requests run under cProfile, posting reset_profiles clears
+# the profiles.
+@admin_blueprint.route('/metrics', methods=['GET', 'POST'])
+@login_required
+@requires_roles('admin')
+def view_metrics():
+    profiler = metrics.profiler(current_app)
+
+    if request.method == 'POST':
+        rate = request.form.get('profile_rate', type=float)
+        if rate is not None:
+            profiler.rate = min(max(rate, 0.0), 1.0)
+            flash('Profiling %g%% of requests.' % (profiler.rate * 100))
+
+        if request.form.get('reset_profiles'):
+            profiler.reset()
+            flash('Profiles cleared.')
+
+    endpoint = request.values.get('endpoint')
+
+    return render_template('metrics.html', rows=metrics.request_metrics(current_app).summary(),
+                           window=current_app.config['METRICS_WINDOW'], profile_rate=profiler.rate,
+                           profiled=profiler.endpoints(), endpoint=endpoint,
+                           profile=profiler.top(endpoint) if endpoint else None,
+                           caches=metrics.cache_stats(current_app), name=current_user.firstname)
+
+
+# request and cache metrics in the Prometheus text format, for admins or a scraper sending the METRICS_TOKEN bearer token
+@admin_blueprint.route('/metrics/prometheus')
+def prometheus_metrics():
+    if not metrics.valid_metrics_token() and \
+            not (current_user.is_authenticated and current_user.role == 'admin'):
+        abort(403, 'Forbidden')
+
+    response = make_response(metrics.request_metrics(current_app).prometheus() +
+                             metrics.cache_prometheus(current_app))
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+
+# QUERIES
+# built here so tests/test_query_plans.py checks the same queries as the views run
+# registered users, listed a page at a time
+def users_query():
+    return User.query.filter_by(role='user')
+
+
+# the current winning draw, and the current winning draw while its round has not been played
+def winning_draw_query():
+    return Draw.query.filter_by(master_draw=True)
+
 
-    return render_template('admin.html', logs=content, name=current_user.firstname)
+def unplayed_winning_draw_query():
+    return Draw.query.filter_by(master_draw=True, been_played=False)
@@ -1,47 +1,62 @@
 # IMPORTS
+import atexit
 import logging
 import os
 import socket
 from functools import wraps
 
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, abort
-from flask_login import current_user, LoginManager
-from flask_sqlalchemy import SQLAlchemy
-from talisman import Talisman
+from flask import Flask, current_app, render_template, request, abort
+from flask_login import current_user
 
-# Importing blueprints
-from admin.views import admin_blueprint
-from lottery.views import lottery_blueprint
-from models import User
-from users.views import users_blueprint
+import metrics
+import page_cache
+from database import configure_database, register_pragmas
+from extensions import db, login_manager, talisman
+from security_log import EVENT_TYPES, SecurityLogHandler, BoundedQueueHandler, SecurityLogListener, event_type
 
 
 # LOGGING
+# keeps the records of security events: messages of one of the EVENT_TYPES, or mentioning security in any case
 class SecurityFilter(logging.Filter):
     def filter(self, record):
-        return "Security" in record.getMessage()
+        message = record.getMessage()
+        return event_type(message) != EVENT_TYPES['other'][0] or 'security' in message.lower()
 
 
-fh = logging.FileHandler('lottery.log', 'w')
-fh.setLevel(logging.WARNING)
-fh.addFilter(SecurityFilter())
-formatter = logging.Formatter('%(asctime)s : %(message)s', '%m/%d/%Y %I:%M:%S %p')
-fh.setFormatter(formatter)
+# listener writing the queued security log records out, one per process however many apps are created
+log_listener = None
 
-logger = logging.getLogger('')
-logger.propagate = False
-logger.addHandler(fh)
 
-# CONFIG
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'LongAndRandomSecretKey'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///lottery.db'
-app.config['SQLALCHEMY_ECHO'] = True
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# send security log records through a bounded queue to the log file, rotated by size and indexed unless LOG_INDEX
+# is off. LOG_QUEUE_OVERFLOW decides what happens when the queue is full (drop_newest, drop_oldest or block).
+# The listener is the only writer of LOG_FILE within a process, and only one process may write it (see security_log),
+# so the app is served by a single worker process.
+def configure_logging(app):
+    global log_listener
+    if log_listener is not None:
+        return
+
+    fh = SecurityLogHandler(app.config['LOG_FILE'], app.config['LOG_MAX_BYTES'], app.config['LOG_BACKUP_COUNT'],
+                            index=app.config['LOG_INDEX'])
+    fh.setLevel(logging.WARNING)
+    fh.addFilter(SecurityFilter())
+    formatter = logging.Formatter('%(asctime)s : %(message)s', '%m/%d/%Y %I:%M:%S %p')
+    fh.setFormatter(formatter)
+
+    qh = BoundedQueueHandler(app.config['LOG_QUEUE_SIZE'], app.config['LOG_QUEUE_OVERFLOW'])
+    qh.setLevel(logging.WARNING)
+
+    log_listener = SecurityLogListener(qh, fh)
+    log_listener.start()
+
+    # write out every queued record on shutdown
+    atexit.register(log_listener.stop)
+
+    logger = logging.getLogger('')
+    logger.propagate = False
+    logger.addHandler(qh)
 
-# Initialise Database
-db = SQLAlchemy(app)
 
 # Security Headers
 cloudfare_security = {
@@ -55,7 +70,137 @@ cloudfare_security = {
     ]
 }
 
-talisman = Talisman(app, content_security_policy=cloudfare_security)
+
+# APP FACTORY
+# create and configure an app. Settings come from the environment (and the .env file), config overrides them, e.g.
+# create_app({'DATABASE_URL': 'sqlite://', 'TESTING': True}). Blueprints are imported here rather than with this
+# module, so importing app stays cheap and the models, blueprints and scripts can import app without a cycle.
+# gunicorn runs it with a single worker, as only one process may write the security log:
+# gunicorn --workers 1 --threads 8 "app:create_app()"
+def create_app(config=None):
+    load_dotenv()
+
+    # CONFIG
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'LongAndRandomSecretKey')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    # Key-pair supplied by Google for reCAPTCHA
+    app.config['RECAPTCHA_PUBLIC_KEY'] = os.getenv('RECAPTCHA_PUBLIC_KEY', '6LfNZFMjAAAAAIO6UDMnvS8N5r8XpnnOjvNtI9-e')
+    app.config['RECAPTCHA_PRIVATE_KEY'] = os.getenv('RECAPTCHA_PRIVATE_KEY')
+
+    # Database engine profile (development or production) and database URI
+    app.config['DATABASE_PROFILE'] = os.getenv('DATABASE_PROFILE', 'development')
+    app.config['DATABASE_URL'] = os.getenv('DATABASE_URL', 'sqlite:///lottery.db')
+
+    # security log rotated by size, with an index of its entries unless LOG_INDEX is 0. Records reach the log file
+    # through a queue of LOG_QUEUE_SIZE records.
+    app.config['LOG_FILE'] = os.getenv('LOG_FILE', 'lottery.log')
+    app.config['LOG_MAX_BYTES'] = int(os.getenv('LOG_MAX_BYTES', 5 * 1024 * 1024))
+    app.config['LOG_BACKUP_COUNT'] = int(os.getenv('LOG_BACKUP_COUNT', 5))
+    app.config['LOG_INDEX'] = os.getenv('LOG_INDEX', '1') == '1'
+    app.config['LOG_QUEUE_SIZE'] = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    app.config['LOG_QUEUE_OVERFLOW'] = os.getenv('LOG_QUEUE_OVERFLOW', 'drop_newest')
+
+    # Lottery settlement (draws are settled and checkpointed in batches, SETTLEMENT_WORKERS above 1 scores each batch
+    # in chunks across a pool of worker processes)
+    app.config['SETTLEMENT_BATCH_SIZE'] = int(os.getenv('SETTLEMENT_BATCH_SIZE', 100000))
+    app.config['SETTLEMENT_WORKERS'] = int(os.getenv('SETTLEMENT_WORKERS', 0))
+    app.config['SETTLEMENT_CHUNK_SIZE'] = int(os.getenv('SETTLEMENT_CHUNK_SIZE', 10000))
+
+    # Login throttling, every attempt takes a token from the buckets of the client IP and the account email which refill
+    # at the given rate (tokens per second). LOGIN_THROTTLE_STORE is memory (one process) or sqlite (shared by workers).
+    app.config['LOGIN_THROTTLE_STORE'] = os.getenv('LOGIN_THROTTLE_STORE', 'memory')
+    app.config['LOGIN_THROTTLE_DATABASE'] = os.getenv('LOGIN_THROTTLE_DATABASE', 'login_throttle.db')
+    app.config['LOGIN_THROTTLE_IP_CAPACITY'] = 20
+    app.config['LOGIN_THROTTLE_IP_RATE'] = 20 / 60
+    app.config['LOGIN_THROTTLE_EMAIL_CAPACITY'] = 3
+    app.config['LOGIN_THROTTLE_EMAIL_RATE'] = 1 / 60
+
+    # Users loaded for authenticated requests are cached for IDENTITY_CACHE_TTL seconds
+    app.config['IDENTITY_CACHE_TTL'] = int(os.getenv('IDENTITY_CACHE_TTL', 60))
+    app.config['IDENTITY_CACHE_SIZE'] = int(os.getenv('IDENTITY_CACHE_SIZE', 10000))
+
+    # Most draws accepted by one bulk submission
+    app.config['BULK_DRAW_LIMIT'] = int(os.getenv('BULK_DRAW_LIMIT', 50000))
+
+    # Most lucky dip draws generated by one request
+    app.config['LUCKY_DIP_LIMIT'] = int(os.getenv('LUCKY_DIP_LIMIT', 100000))
+
+    # Draw key rotation (key_rotation.py) re-encrypts draws in checkpointed batches, KEY_ROTATION_WORKERS above 1
+    # re-encrypts each batch in chunks across a pool of worker processes. Old keys are kept for at least
+    # KEY_ROTATION_GRACE seconds after the new key is in use.
+    app.config['KEY_ROTATION_BATCH_SIZE'] = int(os.getenv('KEY_ROTATION_BATCH_SIZE', 10000))
+    app.config['KEY_ROTATION_WORKERS'] = int(os.getenv('KEY_ROTATION_WORKERS', 0))
+    app.config['KEY_ROTATION_CHUNK_SIZE'] = int(os.getenv('KEY_ROTATION_CHUNK_SIZE', 1000))
+    app.config['KEY_ROTATION_GRACE'] = int(os.getenv('KEY_ROTATION_GRACE', 5))
+
+    # Played draws of settled rounds are moved to the column files of the archive in ARCHIVE_DIRECTORY
+    app.config['ARCHIVE_DIRECTORY'] = os.getenv('ARCHIVE_DIRECTORY', 'archive')
+
+    # Rendered pages are cached up to PAGE_CACHE_MAX_BYTES in total, for at most PAGE_CACHE_TTL seconds
+    app.config['PAGE_CACHE_MAX_BYTES'] = int(os.getenv('PAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    app.config['PAGE_CACHE_TTL'] = int(os.getenv('PAGE_CACHE_TTL', 300))
+
+    # Request metrics are shown for the last METRICS_WINDOW seconds, METRICS_PROFILE_RATE of requests (0 to 1) are run
+    # under cProfile and Prometheus can scrape the metrics with the bearer token METRICS_TOKEN
+    app.config['METRICS_WINDOW'] = int(os.getenv('METRICS_WINDOW', 300))
+    app.config['METRICS_PROFILE_RATE'] = float(os.getenv('METRICS_PROFILE_RATE', 0))
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+
+    # Rows read and encoded at a time by the streamed admin exports
+    app.config['EXPORT_BATCH_SIZE'] = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+
+    # Seconds a background job can go without reporting progress before it is treated as dead
+    app.config['JOB_TIMEOUT'] = int(os.getenv('JOB_TIMEOUT', 600))
+
+    app.config.update(config or {})
+    configure_database(app, app.config['DATABASE_PROFILE'], app.config['DATABASE_URL'])
+    configure_logging(app)
+
+    # Initialise Database, login and security headers
+    db.init_app(app)
+    login_manager.init_app(app)
+    talisman.init_app(app, content_security_policy=cloudfare_security)
+
+    # New connections get the SQLite pragmas of the profile, cached pages are invalidated by writes to the tables they
+    # show, every request and query is measured
+    with app.app_context():
+        register_pragmas(app, db.engine)
+        page_cache.register_invalidation(db.engine)
+        metrics.register_instrumentation(app, db.engine)
+    app.jinja_env.globals['cache_fragment'] = page_cache.cache_fragment
+
+    # Importing blueprints
+    from admin.views import admin_blueprint
+    from lottery.views import lottery_blueprint
+    from models import fernet_cache_info
+    from users import identity
+    from users.views import users_blueprint
+
+    identity.register_invalidation()
+    metrics.register_cache(app, 'identity', lambda: identity.identity_cache(app).stats())
+    metrics.register_cache(app, 'fernet', fernet_cache_info)
+    metrics.register_cache(app, 'page', lambda: page_cache.page_cache(app).stats())
+
+    @login_manager.user_loader
+    def load_user(id):
+        return identity.load_user(current_app, id)
+
+    # register blueprints with app
+    app.register_blueprint(users_blueprint)
+    app.register_blueprint(admin_blueprint)
+    app.register_blueprint(lottery_blueprint)
+
+    app.add_url_rule('/', 'index', index)
+
+    app.register_error_handler(400, error_400)
+    app.register_error_handler(403, error_403)
+    app.register_error_handler(404, error_404)
+    app.register_error_handler(500, error_500)
+    app.register_error_handler(503, error_503)
+
+    return app
 
 
 # FUNCTIONS
@@ -79,50 +224,30 @@ def requires_roles(*roles):
 
 
 # HOME PAGE VIEW
-@app.route('/')
 def index():
-    return render_template('index.html')
+    return page_cache.render_cached('index.html')
 
 
 # Handling all different types of errors with custom error handlers for each type of error along wth their html template
-@app.errorhandler(400)
 def error_400(error):
-    return render_template('400.html', error=error)
+    return render_template('400.html', error=error), 400
 
 
-@app.errorhandler(403)
 def error_403(error2):
-    return render_template('403.html', error=error2)
+    return render_template('403.html', error=error2), 403
 
 
-@app.errorhandler(404)
 def error_404(error3):
-    return render_template('404.html', error=error3)
+    return render_template('404.html', error=error3), 404
 
 
-@app.errorhandler(500)
 def error_500(error4):
-    return render_template('500.html', error=error4)
+    return render_template('500.html', error=error4), 500
 
 
-@app.errorhandler(503)
 def error_503(error5):
-    return render_template('503.html', error=error5)
-
-
-# # register blueprints with app
-app.register_blueprint(users_blueprint)
-app.register_blueprint(admin_blueprint)
-app.register_blueprint(lottery_blueprint)
-
-# Using the .env file for the SECRET_KEY
-load_dotenv()
-app = Flask(__name__)
-app.config['HelloLotteryApp'] = os.getenv('HelloLotteryApp')
+    return render_template('503.html', error=error5), 503
 
-# Using the .env file for the key-pair supplied by Google
-app.config['6LfNZFMjAAAAAIO6UDMnvS8N5r8XpnnOjvNtI9-e'] = os.getenv('6LfNZFMjAAAAAIO6UDMnvS8N5r8XpnnOjvNtI9-e')
-app.config['6LfNZFMjAAAAAIO6UDMnvS8N5r8XpnnOjvNtI9-e'] = os.getenv('6LfNZFMjAAAAAIO6UDMnvS8N5r8XpnnOjvNtI9-e')
 
 if __name__ == "__main__":
     my_host = "127.0.0.1"
@@ -132,19 +257,4 @@ if __name__ == "__main__":
     free_port = free_socket.getsockname()[1]
     free_socket.close()
 
-    login_manager = LoginManager()
-    login_manager.login_view = 'users.login'
-    login_manager.init_app(app)
-
-
-    @login_manager.user_loader
-    def load_user(id):
-        return User.query.get(int(id))
-
-
-    # register blueprints with app
-    app.register_blueprint(users_blueprint)
-    app.register_blueprint(admin_blueprint)
-    app.register_blueprint(lottery_blueprint)
-
-    app.run(host=my_host, port=free_port, debug=True)
+    create_app().run(host=my_host, port=free_port, debug=True)
@@ -0,0 +1,222 @@
+# Benchmark of the app's routes through the Flask test client at several data sizes, every endpoint runs in its own
+# process against a seeded database and reports latency percentiles, throughput and peak RSS. Results are written as
+# JSON named after the current commit so runs of different commits can be compared. Endpoints that answer with an
+# error status are reported as failed and make the run exit with status 1, their timings are not comparable.
+# run from the LotteryWebApp directory: python -m benchmarks.app_routes [requests] [output]
+# IMPORTS
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# CONFIG
+# (users, draws, rounds) seeded for each run
+DATA_SIZES = ((100, 10000, 10), (1000, 100000, 10), (10000, 1000000, 10))
+ENDPOINTS = ('login', 'add_draw', 'view_draws', 'run_lottery')
+RESULTS_DIRECTORY = os.path.join('benchmarks', 'results')
+# the test client sends https requests, Talisman redirects plain http ones
+BASE_URL = 'https://localhost'
+# most seconds to wait for the settlement job started by run_lottery
+SETTLEMENT_TIMEOUT = 600
+
+
+# FUNCTIONS
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+# peak resident set size of this process in MB (ru_maxrss is in KB on Linux and bytes on macOS)
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def summary(latencies, elapsed, statuses):
+    latencies = np.array(latencies) * 1000
+    return {'requests': len(latencies),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+            'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+            'mean_ms': round(float(latencies.mean()), 3),
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'statuses': {str(status): statuses.count(status) for status in sorted(set(statuses))}}
+
+
+# seed the database in a child process
+def seed_database(database_uri, users, draws, rounds):
+    from app import create_app
+    import seed
+
+    with create_app({'DATABASE_URL': database_uri, 'DATABASE_PROFILE': 'production'}).app_context():
+        seed.seed(users, draws, rounds, seed_value=0)
+
+
+# the app with the settings that make the test client usable for benchmarking. TESTING skips the reCAPTCHA check,
+# exceptions are not propagated so a failing endpoint answers 500 and is reported instead of ending the run.
+def benchmark_app(database_uri):
+    from app import create_app
+
+    return create_app({'DATABASE_URL': database_uri, 'DATABASE_PROFILE': 'production',
+                       'TESTING': True, 'PROPAGATE_EXCEPTIONS': False,
+                       'WTF_CSRF_ENABLED': False, 'LOGIN_THROTTLE_IP_CAPACITY': 10 ** 9,
+                       'LOGIN_THROTTLE_EMAIL_CAPACITY': 10 ** 9})
+
+
+# True if every request was answered without an error status (logins answer with a redirect)
+def succeeded(statuses):
+    return all(status < 400 for status in statuses)
+
+
+# log the test client in as the user, without going through the login form
+def log_in(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+def login_request(client, accounts, rng):
+    import pyotp
+    import seed
+
+    account = rng.choice(accounts)
+    return client.post('/login', base_url=BASE_URL, data={'username': account.email,
+                                                          'password': seed.SEED_PASSWORD,
+                                                          'pin': pyotp.TOTP(account.pin_key).now()})
+
+
+def add_draw_request(client, accounts, rng):
+    numbers = rng.sample(range(1, 61), 6)
+    return client.post('/add_draw', base_url=BASE_URL,
+                       data={'no%d' % (i + 1): number for i, number in enumerate(numbers)})
+
+
+def view_draws_request(client, accounts, rng):
+    return client.post('/view_draws', base_url=BASE_URL)
+
+
+# run the lottery and wait for the settlement job to finish, so the latency covers the whole round
+def run_lottery_request(client, accounts, rng):
+    import models
+
+    response = client.post('/run_lottery', base_url=BASE_URL)
+    with client.application.app_context():
+        job_id = models.Job.query.with_entities(models.Job.id).order_by(models.Job.id.desc()).scalar()
+
+    # every poll is a request of its own, in a new app context and so a new session that reads the job's progress
+    # from the database rather than from the identity map of an earlier poll
+    deadline = time.monotonic() + SETTLEMENT_TIMEOUT
+    while job_id is not None:
+        progress = client.get('/admin/jobs/%d' % job_id, base_url=BASE_URL).get_json()
+        if progress is None or progress['status'] in ('completed', 'failed'):
+            break
+        if time.monotonic() > deadline:
+            raise TimeoutError('settlement job %d not finished after %ds' % (job_id, SETTLEMENT_TIMEOUT))
+        time.sleep(0.01)
+
+    return response
+
+
+# request made for each endpoint, the role of the user making it and the most requests made (None = no limit)
+ENDPOINT_REQUESTS = {
+    'login': (login_request, None, None),
+    'add_draw': (add_draw_request, 'user', None),
+    'view_draws': (view_draws_request, 'user', None),
+    # the seeded round can only be run once
+    'run_lottery': (run_lottery_request, 'admin', 1),
+}
+
+
+# benchmark one endpoint in a child process, so its peak RSS is not shared with the other endpoints
+def benchmark_endpoint(database_uri, endpoint, requests):
+    flask_app = benchmark_app(database_uri)
+    import models
+
+    make_request, role, most_requests = ENDPOINT_REQUESTS[endpoint]
+    requests = min(requests, most_requests or requests)
+    rng = random.Random(0)
+
+    # the accounts are loaded in a context of their own, requests are made outside any app context so each one gets
+    # a fresh context and session like a request to the running app
+    with flask_app.app_context():
+        accounts = models.User.query.order_by(models.User.id).all()
+    client = flask_app.test_client()
+
+    if role is not None:
+        log_in(client, next(account.id for account in accounts if account.role == role))
+
+    rss_before = peak_rss_mb()
+    latencies, statuses = [], []
+    start = time.perf_counter()
+    for _ in range(requests):
+        request_start = time.perf_counter()
+        response = make_request(client, accounts, rng)
+        latencies.append(time.perf_counter() - request_start)
+        statuses.append(response.status_code)
+    elapsed = time.perf_counter() - start
+
+    result = summary(latencies, elapsed, statuses)
+    result['succeeded'] = succeeded(statuses)
+    result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    result['rss_growth_mb'] = round(peak_rss_mb() - rss_before, 1)
+    return result
+
+
+def main(requests, output):
+    context = multiprocessing.get_context('spawn')
+    results = {'commit': current_commit(),
+               'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(),
+               'requests': requests,
+               'runs': []}
+    failed = []
+
+    for users, draws, rounds in DATA_SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            database_uri = 'sqlite:///' + os.path.join(directory, 'benchmark.db')
+
+            with context.Pool(1) as pool:
+                start = time.perf_counter()
+                pool.apply(seed_database, (database_uri, users, draws, rounds))
+                seed_time = time.perf_counter() - start
+
+            run = {'users': users, 'draws': draws, 'rounds': rounds, 'seed_seconds': round(seed_time, 3),
+                   'endpoints': {}}
+
+            # run_lottery goes last as it settles the seeded round
+            for endpoint in ENDPOINTS:
+                with context.Pool(1) as pool:
+                    result = pool.apply(benchmark_endpoint, (database_uri, endpoint, requests))
+                run['endpoints'][endpoint] = result
+                if not result['succeeded']:
+                    failed.append('%s at %d draws' % (endpoint, draws))
+
+                print('%-8d %-9d %-12s p50 %9.3fms  p99 %9.3fms  %8.1f req/s  peak RSS %7.1fMB  %s%s'
+                      % (users, draws, endpoint, result['p50_ms'], result['p99_ms'], result['throughput_rps'],
+                         result['peak_rss_mb'], result['statuses'], '' if result['succeeded'] else '  FAILED'))
+
+            results['runs'].append(run)
+
+    output = output or os.path.join(RESULTS_DIRECTORY, '%s.json' % results['commit'])
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print('Results written to %s' % output)
+
+    if failed:
+        print('Endpoints answering with an error status: %s' % ', '.join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200, sys.argv[2] if len(sys.argv) > 2 else None)
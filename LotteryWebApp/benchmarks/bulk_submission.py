@@ -0,0 +1,69 @@
+# Benchmark of submitting draws one per request and commit (add_draw) against one bulk submission (add_draws)
+# run from the LotteryWebApp directory: python -m benchmarks.bulk_submission [tickets]
+# IMPORTS
+import os
+import random
+import sys
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+from sqlalchemy import create_engine, text
+
+from lottery.draws import parse_draw, pack_draw, validate_draws
+
+# CONFIG
+INSERT_DRAW = text('INSERT INTO draws (user_id, numbers, been_played, matches_master, master_draw, lottery_round) '
+                   'VALUES (:user_id, :numbers, 0, 0, 0, 0)')
+
+
+# FUNCTIONS
+def create_database(directory, name):
+    engine = create_engine('sqlite:///' + os.path.join(directory, name))
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE draws (id INTEGER PRIMARY KEY, user_id INTEGER, numbers VARCHAR(100), '
+                                'been_played BOOLEAN, matches_master BOOLEAN, master_draw BOOLEAN, '
+                                'lottery_round INTEGER)'))
+    return engine
+
+
+# one draw validated, encrypted, inserted and committed at a time
+def submit_one_by_one(engine, draws, draw_key):
+    for values in draws:
+        numbers = parse_draw(values)
+        with engine.begin() as connection:
+            connection.execute(INSERT_DRAW, {'user_id': 1,
+                                             'numbers': Fernet(draw_key).encrypt(pack_draw(numbers))})
+
+
+# every draw validated in one pass, then encrypted and inserted with one executemany in one transaction
+def submit_bulk(engine, draws, draw_key):
+    valid_draws, errors = validate_draws(draws)
+    fernet = Fernet(draw_key)
+    with engine.begin() as connection:
+        connection.execute(INSERT_DRAW, [{'user_id': 1,
+                                          'numbers': fernet.encrypt(pack_draw(numbers))}
+                                         for numbers in valid_draws])
+
+
+def main(tickets):
+    draws = [random.sample(range(1, 61), 6) for _ in range(tickets)]
+    draw_key = Fernet.generate_key()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, submit in (('one by one', submit_one_by_one), ('bulk', submit_bulk)):
+            engine = create_database(directory, name.replace(' ', '_') + '.db')
+
+            start = time.perf_counter()
+            submit(engine, draws, draw_key)
+            elapsed = time.perf_counter() - start
+
+            with engine.connect() as connection:
+                assert connection.execute(text('SELECT COUNT(*) FROM draws')).scalar() == tickets
+            engine.dispose()
+
+            print('%-10s %d tickets in %.3fs (%.0f tickets/s)' % (name, tickets, elapsed, tickets / elapsed))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
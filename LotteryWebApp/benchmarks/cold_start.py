@@ -0,0 +1,83 @@
+# Benchmark of worker cold start: importing app, create_app and the first request, each run in a fresh interpreter.
+# The eager runs also import what the app used to import up front (cryptography, pyotp, numpy and the modules using
+# it), so the two show what the lazy imports save. The slowest modules imported by app are listed from
+# python -X importtime.
+# run from the LotteryWebApp directory: python -m benchmarks.cold_start [runs]
+# IMPORTS
+import json
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+# CONFIG
+SLOWEST_IMPORTS = 10
+# modules left out of a lazy cold start
+LAZY_MODULES = ('cryptography', 'pyotp', 'numpy', 'admin.jobs', 'lottery.archive', 'lottery.lucky_dip')
+EAGER_IMPORTS = ('import cryptography.fernet, pyotp, numpy, admin.jobs, lottery.archive, lottery.statistics, '
+                 'lottery.lucky_dip')
+
+# one cold start, timed in the child and printed as JSON
+COLD_START = '''
+import json, sys, time
+start = time.perf_counter()
+%(eager)s
+import app
+imported = time.perf_counter()
+flask_app = app.create_app({'DATABASE_URL': %(database_uri)r, 'METRICS_TOKEN': 'benchmark'})
+created = time.perf_counter()
+response = flask_app.test_client().get('https://localhost/metrics/prometheus',
+                                       headers={'Authorization': 'Bearer benchmark'})
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({'import_ms': (imported - start) * 1000,
+                  'create_app_ms': (created - imported) * 1000,
+                  'first_request_ms': (served - created) * 1000,
+                  'total_ms': (served - start) * 1000,
+                  'modules': len(sys.modules),
+                  'loaded': [name for name in %(lazy)r if name in sys.modules]}))
+'''
+
+
+# FUNCTIONS
+def cold_start(database_uri, eager):
+    script = COLD_START % {'eager': EAGER_IMPORTS if eager else '', 'database_uri': database_uri,
+                           'lazy': LAZY_MODULES}
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+# (cumulative microseconds, module) of the slowest modules imported by app
+def slowest_imports():
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], capture_output=True,
+                            text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), module.rstrip()))
+    return sorted(imports, reverse=True)[:SLOWEST_IMPORTS]
+
+
+def main(runs):
+    with tempfile.TemporaryDirectory() as directory:
+        database_uri = 'sqlite:///%s/cold_start.db' % directory
+
+        for name, eager in (('lazy', False), ('eager', True)):
+            starts = [cold_start(database_uri, eager) for _ in range(runs)]
+            print('%s (%d runs, %d modules, loaded %s)' % (name, runs, starts[0]['modules'],
+                                                          ', '.join(starts[0]['loaded']) or 'none'))
+            for measure in ('import_ms', 'create_app_ms', 'first_request_ms', 'total_ms'):
+                values = np.array([start[measure] for start in starts])
+                print('    %-17s p50 %8.1f   min %8.1f   max %8.1f' % (measure, np.percentile(values, 50),
+                                                                       values.min(), values.max()))
+
+    print('slowest imports of app (cumulative):')
+    for cumulative, module in slowest_imports():
+        print('    %8.1f ms  %s' % (cumulative / 1000, module))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,77 @@
+# Benchmark of draws encrypted as text ("1 2 3 4 5 6 ", as stored before the packed format) against draws encrypted
+# packed into an 8-byte mask. Reports the size of the encrypted numbers and of the database, and the throughput of
+# decrypting the draws to masks for matching and to numbers for display.
+# run from the LotteryWebApp directory: python -m benchmarks.draw_encoding [draws]
+# IMPORTS
+import os
+import random
+import sys
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+from sqlalchemy import create_engine, text
+
+from lottery.draws import DRAW_SIZE, numbers_mask, pack_draw, plaintext_mask, unpack_draw
+
+# CONFIG
+INSERT_BATCH_SIZE = 10000
+
+
+# FUNCTIONS
+# a draw as the text add_draw and create_winning_draw stored, with the trailing space of create_winning_draw
+def text_draw(numbers):
+    return ''.join('%d ' % number for number in numbers).encode('utf-8')
+
+
+# draws table of the given draws encoded with encode, returns the engine and the size of the database file
+def create_database(path, draws, f, encode):
+    engine = create_engine('sqlite:///' + path)
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE draws (id INTEGER PRIMARY KEY, numbers VARCHAR(100))'))
+        for first in range(0, len(draws), INSERT_BATCH_SIZE):
+            connection.execute(text('INSERT INTO draws (numbers) VALUES (:numbers)'),
+                               [{'numbers': f.encrypt(encode(numbers))}
+                                for numbers in draws[first:first + INSERT_BATCH_SIZE]])
+    engine.dispose()
+    return engine, os.path.getsize(path)
+
+
+# seconds to decrypt every draw and convert it with convert
+def decrypt_all(engine, f, convert):
+    with engine.connect() as connection:
+        tokens = connection.execute(text('SELECT numbers FROM draws ORDER BY id')).scalars().all()
+
+    start = time.perf_counter()
+    for token in tokens:
+        convert(f.decrypt(token.encode('ascii') if isinstance(token, str) else token))
+    return time.perf_counter() - start
+
+
+def main(count):
+    rng = random.Random(0)
+    draws = [rng.sample(range(1, 61), DRAW_SIZE) for _ in range(count)]
+    f = Fernet(Fernet.generate_key())
+
+    # both formats decrypt to the same mask and numbers
+    for numbers in draws[:1000]:
+        assert plaintext_mask(text_draw(numbers)) == plaintext_mask(pack_draw(numbers)) == numbers_mask(numbers)
+        assert unpack_draw(text_draw(numbers)) == unpack_draw(pack_draw(numbers))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, encode in (('text', text_draw), ('packed', pack_draw)):
+            engine, database_size = create_database(os.path.join(directory, name + '.db'), draws, f, encode)
+            with engine.connect() as connection:
+                numbers_size = connection.execute(text('SELECT SUM(LENGTH(numbers)) FROM draws')).scalar()
+
+            mask_time = decrypt_all(engine, f, plaintext_mask)
+            numbers_time = decrypt_all(engine, f, unpack_draw)
+            engine.dispose()
+
+            print('%-6s %d draws: numbers %.1f MB (%.1f bytes/draw), database %.1f MB, decrypt to mask %.0f draws/s, '
+                  'to numbers %.0f draws/s' % (name, count, numbers_size / 1024 / 1024, numbers_size / count,
+                                               database_size / 1024 / 1024, count / mask_time, count / numbers_time))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,110 @@
+# Benchmark of mixed add_draw and view_draws traffic against each database engine profile, on the engine the app
+# creates for the profile with its pool options, SQLite pragmas and listeners, against the app's full schema
+# run from the LotteryWebApp directory: python -m benchmarks.engine_profiles [seconds] [threads]
+# IMPORTS
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from cryptography.fernet import Fernet
+from sqlalchemy import text
+
+from database import ENGINE_PROFILES
+
+# CONFIG
+# share of requests that submit a draw, the rest view playable draws
+WRITE_SHARE = 0.2
+USERS = 100
+SEEDED_DRAWS = 10000
+# a user draw of the current round, as add_draw stores it
+INSERT_DRAW = text('INSERT INTO draws (user_id, numbers, been_played, matches_master, match_count, master_draw, '
+                   'lottery_round) VALUES (:user_id, :numbers, 0, 0, 0, 0, 0)')
+
+
+# FUNCTIONS
+def create_profile_engine(profile, database_uri):
+    from app import create_app
+    from extensions import db
+
+    flask_app = create_app({'DATABASE_URL': database_uri, 'DATABASE_PROFILE': profile})
+    with flask_app.app_context():
+        db.create_all()
+        engine = db.engine
+
+    # the benchmark talks to the engine directly, echo would only measure printing
+    engine.echo = False
+    return engine
+
+
+def seed(engine, draw_key):
+    fernet = Fernet(draw_key)
+    with engine.begin() as connection:
+        connection.execute(INSERT_DRAW,
+                           [{'user_id': random.randint(1, USERS), 'numbers': fernet.encrypt(b'1 2 3 4 5 6')}
+                            for _ in range(SEEDED_DRAWS)])
+
+
+# add_draw: insert one encrypted draw and commit
+def add_draw(engine, fernet):
+    numbers = ' '.join(str(number) for number in sorted(random.sample(range(1, 61), 6)))
+    with engine.begin() as connection:
+        connection.execute(INSERT_DRAW,
+                           {'user_id': random.randint(1, USERS), 'numbers': fernet.encrypt(numbers.encode('utf-8'))})
+
+
+# view_draws: read the playable draws of one user
+def view_draws(engine):
+    with engine.connect() as connection:
+        connection.execute(text('SELECT id, numbers FROM draws WHERE been_played = 0 AND user_id = :user_id'),
+                           {'user_id': random.randint(1, USERS)}).all()
+
+
+def client(engine, fernet, deadline, latencies):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        if random.random() < WRITE_SHARE:
+            add_draw(engine, fernet)
+            latencies['add_draw'].append(time.perf_counter() - start)
+        else:
+            view_draws(engine)
+            latencies['view_draws'].append(time.perf_counter() - start)
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+def run_profile(profile, seconds, threads):
+    with tempfile.TemporaryDirectory() as directory:
+        draw_key = Fernet.generate_key()
+        engine = create_profile_engine(profile, 'sqlite:///' + os.path.join(directory, 'benchmark.db'))
+        seed(engine, draw_key)
+
+        latencies = {'add_draw': [], 'view_draws': []}
+        deadline = time.perf_counter() + seconds
+        clients = [threading.Thread(target=client, args=(engine, Fernet(draw_key), deadline, latencies))
+                   for _ in range(threads)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        engine.dispose()
+
+    for endpoint, values in latencies.items():
+        print('%-12s %-11s %8.0f req/s  p50 %7.2fms  p99 %7.2fms' % (
+            profile, endpoint, len(values) / seconds, percentile(values, 0.5) * 1000, percentile(values, 0.99) * 1000))
+
+
+def main(seconds, threads):
+    print('%d threads, %.0f%% writes, %ds per profile' % (threads, WRITE_SHARE * 100, seconds))
+    for profile in ENGINE_PROFILES:
+        run_profile(profile, seconds, threads)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 8)
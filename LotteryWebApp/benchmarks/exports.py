@@ -0,0 +1,80 @@
+# Benchmark of the streamed admin exports against building the whole export in memory first, the way the admin
+# views build their tables. Reports the time to the first byte, the total time and the peak Python memory of each.
+# run from the LotteryWebApp directory: python -m benchmarks.exports [draws]
+# IMPORTS
+import csv
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# CONFIG
+USERS = 1000
+ROUNDS = 10
+
+
+# FUNCTIONS
+# the ticket export built from a list of every draw, returned in one piece
+def materialised_export():
+    from models import Draw
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('draw_id', 'user_id', 'lottery_round', 'been_played', 'match_count', 'archived'))
+    for draw in Draw.query.filter_by(master_draw=False).order_by(Draw.id).all():
+        writer.writerow((draw.id, draw.user_id, draw.lottery_round, draw.been_played, draw.match_count, False))
+    yield buffer.getvalue().encode('utf-8')
+
+
+def streamed_export():
+    from admin.exports import stream_export
+
+    return stream_export('tickets', 'csv').response
+
+
+# time to the first chunk, total time and bytes of reading an export, then its peak Python memory in a second read
+# (tracing allocations slows the read down too much to time it)
+def measure(flask_app, export):
+    with flask_app.test_request_context():
+        start = time.perf_counter()
+        first_byte = None
+        size = 0
+
+        for chunk in export():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            size += len(chunk)
+
+        elapsed = time.perf_counter() - start
+
+    with flask_app.test_request_context():
+        tracemalloc.start()
+        for _ in export():
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return first_byte, elapsed, size, peak
+
+
+def main(draws):
+    from app import create_app
+    import seed
+
+    with tempfile.TemporaryDirectory() as directory:
+        flask_app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(directory, 'exports.db'),
+                                'DATABASE_PROFILE': 'production',
+                                'ARCHIVE_DIRECTORY': directory})
+        with flask_app.app_context():
+            seed.seed(USERS, draws, ROUNDS, seed_value=0)
+
+        for name, export in (('in memory', materialised_export), ('streamed', streamed_export)):
+            first_byte, elapsed, size, peak = measure(flask_app, export)
+            print('%-10s %d draws, %.1f MB: first byte %.3fs, total %.3fs, peak memory %.1f MB'
+                  % (name, draws, size / 1024 / 1024, first_byte, elapsed, peak / 1024 / 1024))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
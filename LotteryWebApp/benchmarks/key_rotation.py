@@ -0,0 +1,102 @@
+# Benchmark of re-encrypting draws with a new key one row and commit at a time (Draw.update_draw) against batched
+# bulk UPDATEs, serially and across worker processes
+# run from the LotteryWebApp directory: python -m benchmarks.key_rotation [tickets]
+# IMPORTS
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from cryptography.fernet import Fernet
+from sqlalchemy import create_engine, text
+
+from draw_keys import draw_fernet, reencrypt, rotating_key
+
+# CONFIG
+BATCH_SIZE = 10000
+CHUNK_SIZE = 1000
+WORKER_COUNTS = (2, 4, 8)
+UPDATE_DRAW = text('UPDATE draws SET numbers = :new_numbers WHERE id = :draw_id AND numbers = :old_numbers')
+
+
+# FUNCTIONS
+def create_database(path, tickets, draw_key):
+    engine = create_engine('sqlite:///' + path)
+    f = Fernet(draw_key)
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE draws (id INTEGER PRIMARY KEY, numbers VARCHAR(100))'))
+        connection.execute(text('INSERT INTO draws (numbers) VALUES (:numbers)'),
+                           [{'numbers': f.encrypt(b'4 8 15 16 23 42')} for _ in range(tickets)])
+    return engine
+
+
+# decrypt, encrypt, update and commit one draw at a time
+def rotate_one_by_one(engine, draw_key, executor):
+    f = draw_fernet(draw_key)
+    with engine.connect() as connection:
+        rows = connection.execute(text('SELECT id, numbers FROM draws ORDER BY id')).all()
+
+    for row in rows:
+        with engine.begin() as connection:
+            connection.execute(UPDATE_DRAW, {'draw_id': row.id, 'old_numbers': row.numbers,
+                                             'new_numbers': f.rotate(row.numbers)})
+
+
+# re-encrypt a batch at a time (in chunks across the executor if there is one), one bulk UPDATE and commit per batch
+def rotate_batched(engine, draw_key, executor):
+    checkpoint = 0
+    while True:
+        with engine.connect() as connection:
+            rows = connection.execute(text('SELECT id, numbers FROM draws WHERE id > :checkpoint ORDER BY id '
+                                           'LIMIT :batch_size'),
+                                      {'checkpoint': checkpoint, 'batch_size': BATCH_SIZE}).all()
+        if not rows:
+            break
+
+        tokens = [row.numbers for row in rows]
+        if executor is not None:
+            chunks = [tokens[i:i + CHUNK_SIZE] for i in range(0, len(tokens), CHUNK_SIZE)]
+            reencrypted = [token for chunk in executor.map(partial(reencrypt, draw_key), chunks) for token in chunk]
+        else:
+            reencrypted = reencrypt(draw_key, tokens)
+
+        with engine.begin() as connection:
+            connection.execute(UPDATE_DRAW, [{'draw_id': row.id, 'old_numbers': row.numbers, 'new_numbers': token}
+                                             for row, token in zip(rows, reencrypted)])
+        checkpoint = rows[-1].id
+
+
+def main(tickets):
+    old_key = Fernet.generate_key()
+    new_key = Fernet.generate_key()
+    draw_key = rotating_key(new_key, old_key)
+
+    runs = [('one by one', rotate_one_by_one, 0), ('batched', rotate_batched, 0)]
+    runs += [('%d workers' % workers, rotate_batched, workers) for workers in WORKER_COUNTS
+             if workers <= os.cpu_count()]
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, rotate, workers in runs:
+            engine = create_database(os.path.join(directory, name.replace(' ', '_') + '.db'), tickets, old_key)
+
+            start = time.perf_counter()
+            if workers:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    rotate(engine, draw_key, executor)
+            else:
+                rotate(engine, draw_key, None)
+            elapsed = time.perf_counter() - start
+
+            # every draw is now readable with the new key alone
+            with engine.connect() as connection:
+                tokens = connection.execute(text('SELECT numbers FROM draws')).scalars().all()
+            assert all(Fernet(new_key).decrypt(token) == b'4 8 15 16 23 42' for token in tokens)
+            engine.dispose()
+
+            print('%-10s %d tickets in %.3fs (%.0f tickets/s)' % (name, tickets, elapsed, tickets / elapsed))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
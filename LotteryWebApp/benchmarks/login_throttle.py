@@ -0,0 +1,78 @@
+# Checks that real requests to /login are throttled, with the throttle kept in memory (one worker) and in SQLite
+# (shared by workers, two apps standing in for two workers). Failed attempts for one account are allowed
+# LOGIN_THROTTLE_EMAIL_CAPACITY times then refused with 429, and attempts from one IP across many accounts are
+# refused after LOGIN_THROTTLE_IP_CAPACITY. Exits with status 1 if either is not throttled.
+# run from the LotteryWebApp directory: python -m benchmarks.login_throttle
+# IMPORTS
+import os
+import sys
+import tempfile
+import time
+
+# CONFIG
+EMAIL_CAPACITY = 3
+IP_CAPACITY = 10
+BASE_URL = 'https://localhost'
+
+
+# FUNCTIONS
+def throttle_apps(directory, store, workers):
+    from app import create_app
+
+    # TESTING skips the reCAPTCHA check, so attempts reach the password check
+    config = {'DATABASE_URL': 'sqlite:///' + os.path.join(directory, 'login.db'), 'DATABASE_PROFILE': 'production',
+              'TESTING': True, 'WTF_CSRF_ENABLED': False, 'LOGIN_THROTTLE_STORE': store,
+              'LOGIN_THROTTLE_DATABASE': os.path.join(directory, 'throttle_%s.db' % store),
+              'LOGIN_THROTTLE_IP_CAPACITY': IP_CAPACITY, 'LOGIN_THROTTLE_EMAIL_CAPACITY': EMAIL_CAPACITY}
+    return [create_app(config) for _ in range(workers)]
+
+
+# status codes of failed logins sent round robin to the apps, for one account or a new account every attempt
+def failed_logins(apps, attempts, ip, same_account):
+    clients = [flask_app.test_client() for flask_app in apps]
+    statuses = []
+    for attempt in range(attempts):
+        email = 'user2@email.com' if same_account else 'attempt%d@email.com' % attempt
+        response = clients[attempt % len(clients)].post('/login', base_url=BASE_URL,
+                                                        environ_base={'REMOTE_ADDR': ip},
+                                                        data={'username': email, 'password': 'wrong',
+                                                              'pin': '123456'})
+        statuses.append(response.status_code)
+    return statuses
+
+
+# True if the first allowed attempts got through and every later one was refused
+def throttled(statuses, allowed):
+    return all(status != 429 for status in statuses[:allowed]) and all(status == 429 for status in statuses[allowed:])
+
+
+def main():
+    import seed
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        apps = throttle_apps(directory, 'memory', 1)
+        with apps[0].app_context():
+            seed.seed(20, 100, 2, seed_value=0)
+
+        for store, workers in (('memory', 1), ('sqlite', 2)):
+            apps = throttle_apps(directory, store, workers)
+
+            start = time.perf_counter()
+            account_statuses = failed_logins(apps, EMAIL_CAPACITY + 3, '10.0.0.1', True)
+            ip_statuses = failed_logins(apps, IP_CAPACITY + 3, '10.0.0.2', False)
+            elapsed = time.perf_counter() - start
+
+            for name, statuses, allowed in (('account', account_statuses, EMAIL_CAPACITY),
+                                            ('ip', ip_statuses, IP_CAPACITY)):
+                ok = throttled(statuses, allowed)
+                failures += not ok
+                print('%-6s %d worker(s) %-7s %s %s' % (store, workers, name, 'throttled' if ok else 'NOT THROTTLED',
+                                                         statuses))
+            print('%-6s %d login requests in %.3fs' % (store, len(account_statuses) + len(ip_statuses), elapsed))
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
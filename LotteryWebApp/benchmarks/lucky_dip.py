@@ -0,0 +1,32 @@
+# Benchmark of the server side lucky dip generator
+# run from the LotteryWebApp directory: python -m benchmarks.lucky_dip [tickets]
+# IMPORTS
+import sys
+import time
+
+import numpy as np
+
+from lottery.draws import LOWEST_NUMBER, HIGHEST_NUMBER
+from lottery.lucky_dip import lucky_dips
+
+
+def main(tickets):
+    start = time.perf_counter()
+    draws = lucky_dips(tickets)
+    elapsed = time.perf_counter() - start
+
+    # every draw is sorted, in range and has no repeated numbers
+    assert draws.shape == (tickets, 6)
+    assert (np.diff(draws.astype(np.int16), axis=1) > 0).all()
+    assert draws.min() >= LOWEST_NUMBER and draws.max() <= HIGHEST_NUMBER
+
+    # every number is picked about equally often
+    frequencies = np.bincount(draws.ravel(), minlength=HIGHEST_NUMBER + 1)[LOWEST_NUMBER:]
+
+    print('%d tickets in %.3fs (%.0f tickets/s)' % (tickets, elapsed, tickets / elapsed))
+    print('number frequency min %d, max %d, expected %.0f' % (frequencies.min(), frequencies.max(),
+                                                               tickets * 6 / (HIGHEST_NUMBER - LOWEST_NUMBER + 1)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
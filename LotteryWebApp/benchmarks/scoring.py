@@ -0,0 +1,60 @@
+# Benchmark of the vectorised prize tier scorer against the per-draw loop run_lottery used before it
+# run from the LotteryWebApp directory: python -m benchmarks.scoring [tickets]
+# IMPORTS
+import random
+import sys
+import time
+
+import numpy as np
+
+from lottery import scoring
+
+
+# FUNCTIONS
+# random draws as "1 2 3 4 5 6" strings
+def random_draws(tickets):
+    return [' '.join(str(number) for number in sorted(random.sample(range(1, 61), 6))) for _ in range(tickets)]
+
+
+# score one draw at a time, the way the loop in run_lottery did
+def score_loop(draws, winning_draw):
+    winning_numbers = set(winning_draw.split())
+    tier_counts = {tier: 0 for tier in scoring.PRIZE_TIERS}
+
+    for draw in draws:
+        match_count = len(winning_numbers.intersection(draw.split()))
+        if match_count in tier_counts:
+            tier_counts[match_count] += 1
+
+    return tier_counts
+
+
+# score all draws at once from their masks
+def score_vectorised(masks, winning_mask):
+    return scoring.tier_counts(scoring.score(masks, winning_mask))
+
+
+def main(tickets):
+    draws = random_draws(tickets)
+    winning_draw = random_draws(1)[0]
+    masks = np.fromiter((scoring.to_mask(draw) for draw in draws), dtype=np.uint64, count=tickets)
+
+    start = time.perf_counter()
+    loop_counts = score_loop(draws, winning_draw)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorised_counts = score_vectorised(masks, scoring.to_mask(winning_draw))
+    vectorised_time = time.perf_counter() - start
+
+    assert loop_counts == vectorised_counts
+
+    print('tickets:         %d' % tickets)
+    print('tier counts:     %s' % vectorised_counts)
+    print('per-draw loop:   %.3fs (%.0f tickets/s)' % (loop_time, tickets / loop_time))
+    print('vectorised:      %.3fs (%.0f tickets/s)' % (vectorised_time, tickets / vectorised_time))
+    print('speed up:        %.0fx' % (loop_time / vectorised_time))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,96 @@
+# Benchmark of the latency the security log adds to the login path. Failed logins are sent to /login through the test
+# client, with the security log handler writing on the request thread (direct) and with the records handed to the log
+# queue and written on the listener thread (queued), the way create_app configures it. Reports the latency of the
+# requests and the lines written to the log by each, and exits with status 1 if either wrote no lines, as its
+# timings would not include writing the log.
+# run from the LotteryWebApp directory: python -m benchmarks.security_logging [attempts]
+# IMPORTS
+import logging
+import os
+import sys
+import tempfile
+import time
+
+# CONFIG
+BASE_URL = 'https://localhost'
+
+
+# FUNCTIONS
+# the app, with a security log in directory and login throttling out of the way
+def login_app(directory):
+    from app import create_app
+
+    # TESTING skips the reCAPTCHA check, so attempts reach the account lookup
+    return create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(directory, 'login.db'),
+                       'DATABASE_PROFILE': 'production',
+                       'LOG_FILE': os.path.join(directory, 'lottery.log'), 'TESTING': True,
+                       'WTF_CSRF_ENABLED': False, 'LOGIN_THROTTLE_IP_CAPACITY': 10 ** 9,
+                       'LOGIN_THROTTLE_EMAIL_CAPACITY': 10 ** 9})
+
+
+# time failed logins of unknown accounts, which are logged without a password check
+def failed_logins(client, attempts):
+    latencies = []
+    for attempt in range(attempts):
+        start = time.perf_counter()
+        client.post('/login', base_url=BASE_URL, data={'username': 'attempt%d@email.com' % attempt,
+                                                        'password': 'wrong', 'pin': '123456'})
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+
+def log_lines(path):
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+def report(name, latencies, lines):
+    print('%-10s p50 %7.3fms  p99 %7.3fms  max %8.3fms  log lines %d'
+          % (name, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000,
+             latencies[-1] * 1000, lines))
+
+
+def main(attempts):
+    import app
+    import seed
+    from security_log import BoundedQueueHandler
+
+    with tempfile.TemporaryDirectory() as directory:
+        flask_app = login_app(directory)
+        with flask_app.app_context():
+            seed.seed(10, 100, 2, seed_value=0)
+
+        log_file = flask_app.config['LOG_FILE']
+        open(log_file, 'ab').close()
+        client = flask_app.test_client()
+        root = logging.getLogger('')
+        queue_handler = next(handler for handler in root.handlers if isinstance(handler, BoundedQueueHandler))
+        file_handler = app.log_listener.handlers[0]
+
+        # after: the handler create_app installs, records are written on the listener thread
+        lines = log_lines(log_file)
+        latencies = failed_logins(client, attempts)
+        # wait for the listener to write out the queued records
+        queue_handler.queue.join()
+        queued_lines = log_lines(log_file) - lines
+        report('queued', latencies, queued_lines)
+        print('dropped:   %d' % queue_handler.dropped)
+
+        # before: the file handler filters and writes on the request thread
+        root.removeHandler(queue_handler)
+        root.addHandler(file_handler)
+        lines = log_lines(log_file)
+        latencies = failed_logins(client, attempts)
+        direct_lines = log_lines(log_file) - lines
+        report('direct', latencies, direct_lines)
+
+        root.removeHandler(file_handler)
+        file_handler.close()
+
+    if not queued_lines or not direct_lines:
+        print('No log lines written')
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
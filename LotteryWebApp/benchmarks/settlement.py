@@ -0,0 +1,69 @@
+# Benchmark of parallel round scoring against worker count, compared with the serial scoring the settlement runs when
+# SETTLEMENT_WORKERS is 1 (admin/settlement.py score_serial). The parallel results must match the serial results.
+# run from the LotteryWebApp directory: python -m benchmarks.settlement [tickets] [users]
+# IMPORTS
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from lottery import scoring
+
+# CONFIG
+WORKER_COUNTS = (1, 2, 4, 8, 16, 32)
+CHUNK_SIZE = 10000
+WINNING_DRAW = '4 8 15 16 23 42'
+
+
+# FUNCTIONS
+# sort winners by draw id so results from different runs can be compared
+def sorted_winners(winner_ids, winner_counts, number_counts):
+    order = np.argsort(winner_ids)
+    return winner_ids[order], winner_counts[order], number_counts
+
+
+def main(tickets, users):
+    from admin import settlement
+    from app import create_app
+    import seed
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_uri = 'sqlite:///' + os.path.join(directory, 'benchmark.db')
+        winning_mask = scoring.to_mask(WINNING_DRAW)
+
+        # one round of unplayed user draws, with ids 1 to tickets
+        with create_app({'DATABASE_URL': database_uri, 'DATABASE_PROFILE': 'production'}).app_context():
+            seed.seed(users, tickets, 1, seed_value=0)
+
+            start = time.perf_counter()
+            serial = sorted_winners(*settlement.score_serial(winning_mask, 1, tickets))
+            serial_time = time.perf_counter() - start
+
+        print('tickets: %d, users: %d, chunk size: %d' % (tickets, users, CHUNK_SIZE))
+        print('serial:     %.3fs (%.0f tickets/s)' % (serial_time, tickets / serial_time))
+
+        for workers in WORKER_COUNTS:
+            if workers > os.cpu_count():
+                break
+
+            # workers are spawned like the settlement's
+            start = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+                parallel = sorted_winners(*scoring.score_parallel(executor, database_uri, winning_mask, 1, tickets,
+                                                                  CHUNK_SIZE))
+            parallel_time = time.perf_counter() - start
+
+            # the parallel results must match the serial results exactly
+            assert all(np.array_equal(serial[i], parallel[i]) for i in range(3))
+
+            print('%2d workers: %.3fs (%.0f tickets/s, %.1fx)' % (workers, parallel_time, tickets / parallel_time,
+                                                                  serial_time / parallel_time))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
@@ -0,0 +1,26 @@
+# Fixtures shared by the tests in tests/, run from the LotteryWebApp directory: python -m pytest
+# IMPORTS
+import pytest
+
+from app import create_app
+from extensions import db
+
+
+# FIXTURES
+# an app on an empty database of its own. TESTING skips the reCAPTCHA check and CSRF is off so forms can be posted.
+@pytest.fixture
+def app(tmp_path):
+    flask_app = create_app({'DATABASE_URL': 'sqlite:///' + str(tmp_path / 'lottery.db'),
+                            'DATABASE_PROFILE': 'production', 'TESTING': True, 'WTF_CSRF_ENABLED': False,
+                            'LOG_FILE': str(tmp_path / 'lottery.log'),
+                            'LOGIN_THROTTLE_DATABASE': str(tmp_path / 'login_throttle.db'),
+                            'ARCHIVE_DIRECTORY': str(tmp_path / 'archive')})
+    with flask_app.app_context():
+        db.create_all()
+    return flask_app
+
+
+# the test client sends https requests, Talisman redirects plain http ones
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,68 @@
+# Database engine profiles. DATABASE_PROFILE selects the profile and DATABASE_URL overrides the database URI, so
+# the same code runs against the development SQLite file or a tuned SQLite/server database in production.
+# IMPORTS
+import sqlite3
+from functools import partial
+
+from sqlalchemy import event
+
+# CONFIG
+ENGINE_PROFILES = {
+    # every query echoed, default SQLite journal
+    'development': {
+        'echo': True,
+        'engine_options': {},
+        'sqlite_pragmas': {},
+    },
+    # no echo, WAL so readers are not blocked by writers, sized connection pool
+    'production': {
+        'echo': False,
+        'engine_options': {
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_pre_ping': True,
+        },
+        'sqlite_pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'mmap_size': 268435456,
+            'cache_size': -65536,
+            'busy_timeout': 5000,
+        },
+    },
+}
+
+
+# FUNCTIONS
+# set the database config of an app from an engine profile
+def configure_database(app, profile, database_uri='sqlite:///lottery.db'):
+    settings = ENGINE_PROFILES[profile]
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config['SQLALCHEMY_ECHO'] = settings['echo']
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(profile, database_uri)
+    app.config['SQLITE_PRAGMAS'] = settings['sqlite_pragmas']
+
+
+# apply the SQLITE_PRAGMAS of an app to every new connection of its engine, other apps' engines are left alone
+def register_pragmas(app, engine):
+    if app.config['SQLITE_PRAGMAS']:
+        event.listen(engine, 'connect', partial(set_sqlite_pragmas, dict(app.config['SQLITE_PRAGMAS'])))
+
+
+# engine options of a profile, in-memory SQLite databases use a single connection so they are not pooled
+def engine_options(profile, database_uri):
+    if database_uri in ('sqlite://', 'sqlite:///:memory:'):
+        return {}
+    return dict(ENGINE_PROFILES[profile]['engine_options'])
+
+
+# connect hook setting the pragmas on SQLite connections (other databases are left alone)
+def set_sqlite_pragmas(pragmas, dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute('PRAGMA %s = %s' % (name, value))
+    cursor.close()
@@ -0,0 +1,52 @@
+# Draw keys. A user's draw_key is one Fernet key, or while the key is being rotated the new key followed by the old
+# key, separated by a space. Draws are encrypted with the first key and decrypted with either key, so every draw
+# stays readable while the user's draws are re-encrypted.
+# cryptography is imported on first use rather than with this module, so processes that never touch a draw (web
+# workers serving other pages, scripts) start without loading it.
+
+
+# FUNCTIONS
+# Fernet of a draw_key, a MultiFernet while the key is being rotated
+def draw_fernet(draw_key):
+    from cryptography.fernet import Fernet, MultiFernet
+
+    keys = draw_key.split()
+    if len(keys) == 1:
+        return Fernet(keys[0])
+    return MultiFernet([Fernet(key) for key in keys])
+
+
+# a new Fernet key
+def new_key():
+    from cryptography.fernet import Fernet
+
+    return Fernet.generate_key()
+
+
+# draw_key used while old_key is rotated to new_key
+def rotating_key(new_key, old_key):
+    return new_key + b' ' + primary_key(old_key)
+
+
+# the key new draws are encrypted with
+def primary_key(draw_key):
+    return draw_key.split()[0]
+
+
+def is_rotating(draw_key):
+    return len(draw_key.split()) > 1
+
+
+# re-encrypt tokens with the primary key of a rotating draw_key, runs in a worker process. Tokens that none of the
+# keys can decrypt are returned as None.
+def reencrypt(draw_key, tokens):
+    from cryptography.fernet import InvalidToken
+
+    f = draw_fernet(draw_key)
+    reencrypted = []
+    for token in tokens:
+        try:
+            reencrypted.append(f.rotate(token))
+        except InvalidToken:
+            reencrypted.append(None)
+    return reencrypted
@@ -0,0 +1,14 @@
+# Flask extensions, created unbound and initialised for an app by app.create_app. Models and blueprints import them
+# from here rather than from app, so importing any of them does not build or import the app.
+# IMPORTS
+from flask_login import LoginManager
+from flask_sqlalchemy import SQLAlchemy
+from talisman import Talisman
+
+# EXTENSIONS
+db = SQLAlchemy()
+
+login_manager = LoginManager()
+login_manager.login_view = 'users.login'
+
+talisman = Talisman()
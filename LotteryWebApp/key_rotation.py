@@ -0,0 +1,185 @@
+# Rotates the draw_key of a user, or of every user, and re-encrypts their draws with the new key.
+# The user's draw_key holds the new and the old key while their draws are re-encrypted, so the app keeps reading and
+# writing their draws throughout (see draw_keys). Draws are re-encrypted in batches of KEY_ROTATION_BATCH_SIZE across
+# KEY_ROTATION_WORKERS processes, each batch is written back with one bulk UPDATE and committed with a checkpoint so
+# an interrupted rotation resumes where it stopped.
+# run from the LotteryWebApp directory: python key_rotation.py <user id | all>
+# IMPORTS
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from functools import partial
+
+from flask import current_app
+from sqlalchemy import bindparam, func, update
+
+from app import create_app
+from draw_keys import is_rotating, new_key, primary_key, reencrypt, rotating_key
+from extensions import db
+from models import User, Draw, KeyRotation
+
+
+# FUNCTIONS
+# draws encrypted with a user's draw_key, admins also encrypt the master draws they create
+def user_draws(user):
+    if user.role == 'admin':
+        return Draw.query.filter((Draw.user_id == user.id) | (Draw.master_draw == True))
+    return Draw.query.filter(Draw.user_id == user.id)
+
+
+# give the user a new draw_key alongside the old one and record a rotation, or get the rotation already started
+def start_rotation(user):
+    rotation = KeyRotation.query.filter_by(user_id=user.id, completed=False).first()
+    if rotation is not None:
+        return rotation
+
+    # draws after this one are encrypted with the new key, as soon as the new key is committed
+    last_draw_id = user_draws(user).with_entities(func.max(Draw.id)).scalar() or 0
+
+    # a key already holding two keys keeps them, replacing its new key would lose the draws encrypted with it
+    if not is_rotating(user.draw_key):
+        user.draw_key = rotating_key(new_key(), user.draw_key)
+    rotation = KeyRotation(user_id=user.id, last_draw_id=last_draw_id)
+    db.session.add(user)
+    db.session.add(rotation)
+    db.session.commit()
+    return rotation
+
+
+# re-encrypt the user's draws from the checkpoint to the last draw of the rotation a batch at a time, yielding the
+# rotation after each batch is committed
+def reencrypt_batches(rotation, user, executor):
+    batch_size = current_app.config['KEY_ROTATION_BATCH_SIZE']
+    draws = user_draws(user)
+
+    while True:
+        rows = draws.filter(Draw.id > rotation.checkpoint, Draw.id <= rotation.last_draw_id) \
+            .with_entities(Draw.id, Draw.numbers) \
+            .order_by(Draw.id) \
+            .limit(batch_size) \
+            .all()
+
+        if not rows:
+            break
+
+        reencrypt_batch(rotation, user.draw_key, rows, executor)
+        yield rotation
+
+
+# re-encrypt a batch of draws and commit them with a new checkpoint
+def reencrypt_batch(rotation, draw_key, rows, executor):
+    tokens = [row.numbers for row in rows]
+
+    if executor is not None:
+        chunk_size = current_app.config['KEY_ROTATION_CHUNK_SIZE']
+        chunks = [tokens[i:i + chunk_size] for i in range(0, len(tokens), chunk_size)]
+        reencrypted = [token for chunk in executor.map(partial(reencrypt, draw_key), chunks) for token in chunk]
+    else:
+        reencrypted = reencrypt(draw_key, tokens)
+
+    # a draw is only written back if it is unchanged, a draw updated meanwhile is already encrypted with the new key.
+    # Master draws created by another admin are not encrypted with this key and are left alone.
+    changes = [{'draw_id': row.id, 'old_numbers': row.numbers, 'new_numbers': token}
+               for row, token in zip(rows, reencrypted) if token is not None]
+    if changes:
+        db.session.execute(update(Draw.__table__)
+                           .where(Draw.__table__.c.id == bindparam('draw_id'),
+                                  Draw.__table__.c.numbers == bindparam('old_numbers'))
+                           .values(numbers=bindparam('new_numbers')),
+                           changes)
+
+    rotation.checkpoint = rows[-1].id
+    rotation.draws_rotated += len(changes)
+    db.session.add(rotation)
+    db.session.commit()
+
+
+# re-encrypt the draws submitted since the rotation started, by requests that loaded the user's draw_key before the
+# new key was committed, then drop the old key. Waits until KEY_ROTATION_GRACE seconds after the rotation started
+# so those requests have finished.
+def finish_rotation(rotation, user, executor):
+    wait = current_app.config['KEY_ROTATION_GRACE'] - (datetime.now() - rotation.started_on).total_seconds()
+    if wait > 0:
+        time.sleep(wait)
+
+    rotation.last_draw_id = user_draws(user).with_entities(func.max(Draw.id)).scalar() or 0
+    for _ in reencrypt_batches(rotation, user, executor):
+        pass
+
+    user.draw_key = primary_key(user.draw_key)
+    rotation.completed = True
+    rotation.finished_on = datetime.now()
+    db.session.add(user)
+    db.session.add(rotation)
+    db.session.commit()
+
+
+def worker_pool():
+    workers = current_app.config['KEY_ROTATION_WORKERS']
+    return ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext()
+
+
+# rotate the draw_key of one user, resuming a rotation that was interrupted
+def rotate_user_key(user_id):
+    user = db.session.get(User, user_id)
+    if user is None:
+        raise ValueError('No user %s' % user_id)
+
+    with worker_pool() as executor:
+        rotation = start_rotation(user)
+        for _ in reencrypt_batches(rotation, user, executor):
+            pass
+        finish_rotation(rotation, user, executor)
+
+    return rotation
+
+
+# rotate the draw_key of every user. Users are rotated in id order and the run is checkpointed after each user, the
+# old keys are dropped once every user's draws are re-encrypted so the grace period is only waited once.
+def rotate_all_keys():
+    run = KeyRotation.query.filter_by(user_id=None, completed=False).first()
+    if run is None:
+        run = KeyRotation(user_id=None, last_draw_id=0)
+        db.session.add(run)
+        db.session.commit()
+
+    with worker_pool() as executor:
+        user_ids = [row.id for row in User.query.filter(User.id > run.checkpoint).with_entities(User.id)
+                    .order_by(User.id)]
+
+        for user_id in user_ids:
+            user = db.session.get(User, user_id)
+            rotation = start_rotation(user)
+            for _ in reencrypt_batches(rotation, user, executor):
+                pass
+
+            run.checkpoint = user.id
+            run.draws_rotated += rotation.draws_rotated
+            db.session.add(run)
+            db.session.commit()
+
+        # users still holding two keys were rotated by this run (or by an interrupted one)
+        for user in User.query.order_by(User.id).all():
+            if is_rotating(user.draw_key):
+                finish_rotation(start_rotation(user), user, executor)
+
+    run.completed = True
+    run.finished_on = datetime.now()
+    db.session.add(run)
+    db.session.commit()
+    return run
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit('usage: python key_rotation.py <user id | all>')
+
+    with create_app().app_context():
+        if sys.argv[1] == 'all':
+            result = rotate_all_keys()
+        else:
+            result = rotate_user_key(int(sys.argv[1]))
+
+    print('%d draws re-encrypted' % result.draws_rotated)
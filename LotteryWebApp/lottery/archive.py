@@ -0,0 +1,219 @@
+# Archive of played lottery rounds. The draws of every settled round are appended to one file per column (draw id,
+# user id, numbers as a 64-bit mask and match count) in ARCHIVE_DIRECTORY, and a record of the round's first row and
+# number of rows is appended to the index. The rows of a round are sorted by user, so the draws of one user are
+# found with a binary search. Reads memory-map the rows of the rounds they need instead of loading the archive.
+# IMPORTS
+import fcntl
+import os
+import time
+
+import numpy as np
+from sqlalchemy import func
+
+from extensions import db
+from lottery import scoring
+from lottery.draws import plaintext_mask
+from models import User, Draw, Settlement, fernet
+
+# CONFIG
+COLUMNS = {
+    'draw_id': np.dtype('<i8'),
+    'user_id': np.dtype('<i4'),
+    'mask': np.dtype('<u8'),
+    'match_count': np.dtype('u1'),
+}
+INDEX_RECORD = np.dtype([('lottery_round', '<i8'), ('first_row', '<i8'), ('rows', '<i8'), ('winning_mask', '<u8'),
+                         ('archived_at', '<f8')])
+INDEX_FILE = 'index.bin'
+LOCK_FILE = 'archive.lock'
+# draws read from the database and decrypted at a time while archiving a round
+ARCHIVE_BATCH_SIZE = 10000
+
+
+# CLASSES
+class RoundArchive:
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    # index records of every archived round, in the order they were archived
+    def index(self):
+        try:
+            return np.fromfile(self.path(INDEX_FILE), dtype=INDEX_RECORD)
+        except FileNotFoundError:
+            return np.empty(0, dtype=INDEX_RECORD)
+
+    def record(self, lottery_round):
+        index = self.index()
+        found = index[index['lottery_round'] == lottery_round]
+        return found[0] if len(found) else None
+
+    # append the draws of a round, unless it is archived already. Columns are written before the index record, so a
+    # round is only visible once all of it is on disk, rows left by an interrupted append are overwritten.
+    def append(self, lottery_round, winning_mask, draw_ids, user_ids, masks, match_counts):
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(self.path(LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            index = self.index()
+            if lottery_round in index['lottery_round']:
+                return False
+
+            first_row = int(index[-1]['first_row'] + index[-1]['rows']) if len(index) else 0
+            order = np.lexsort((draw_ids, user_ids))
+            columns = {'draw_id': draw_ids, 'user_id': user_ids, 'mask': masks, 'match_count': match_counts}
+
+            for name, dtype in COLUMNS.items():
+                with open(self.path(name + '.bin'), 'ab') as file:
+                    file.truncate(first_row * dtype.itemsize)
+                    file.write(np.asarray(columns[name], dtype=dtype)[order].tobytes())
+                    file.flush()
+                    os.fsync(file.fileno())
+
+            record = np.array([(lottery_round, first_row, len(order), winning_mask, time.time())], dtype=INDEX_RECORD)
+            with open(self.path(INDEX_FILE), 'ab') as file:
+                file.write(record.tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+
+        return True
+
+    # the columns of an archived round, memory-mapped (None if the round is not archived)
+    def read_round(self, lottery_round):
+        record = self.record(lottery_round)
+        if record is None:
+            return None
+        return self.columns(record)
+
+    def columns(self, record):
+        first_row, rows = int(record['first_row']), int(record['rows'])
+        if rows == 0:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+        return {name: np.memmap(self.path(name + '.bin'), dtype=dtype, mode='r', offset=first_row * dtype.itemsize,
+                                shape=(rows,))
+                for name, dtype in COLUMNS.items()}
+
+    # number of draws, draws in every prize tier and jackpot winners of every archived round, newest round first
+    def rounds(self):
+        results = []
+        for record in self.index()[::-1]:
+            columns = self.columns(record)
+            jackpot = np.flatnonzero(columns['match_count'] == scoring.PRIZE_TIERS[-1])
+            results.append({'lottery_round': int(record['lottery_round']),
+                            'draws': int(record['rows']),
+                            'winning_numbers': scoring.to_numbers(record['winning_mask']) or None,
+                            'tiers': scoring.tier_counts(columns['match_count']),
+                            'jackpot_winners': [int(user_id) for user_id in columns['user_id'][jackpot]],
+                            'archived_at': float(record['archived_at'])})
+        return results
+
+    # archived draws of a user in the rounds before before_round (all rounds if None), newest round first. Whole
+    # rounds are read until there are at least limit draws. Returns the draws and the round to continue before
+    # (None when there are no older rounds).
+    def user_history(self, user_id, before_round=None, limit=50):
+        index = np.sort(self.index(), order='lottery_round')[::-1]
+        if before_round is not None:
+            index = index[index['lottery_round'] < before_round]
+
+        draws = []
+        for position, record in enumerate(index):
+            columns = self.columns(record)
+            first = np.searchsorted(columns['user_id'], user_id, side='left')
+            last = np.searchsorted(columns['user_id'], user_id, side='right')
+
+            for row in range(first, last):
+                draws.append({'id': int(columns['draw_id'][row]),
+                              'numbers': scoring.to_numbers(columns['mask'][row]),
+                              'lottery_round': int(record['lottery_round']),
+                              'match_count': int(columns['match_count'][row]),
+                              'matches_master': int(columns['match_count'][row]) == scoring.PRIZE_TIERS[-1]})
+
+            if len(draws) >= limit:
+                next_round = int(record['lottery_round']) if position + 1 < len(index) else None
+                return draws, next_round
+
+        return draws, None
+
+
+# FUNCTIONS
+# the round archive of an app
+def round_archive(app):
+    if 'round_archive' not in app.extensions:
+        app.extensions['round_archive'] = RoundArchive(app.config['ARCHIVE_DIRECTORY'])
+    return app.extensions['round_archive']
+
+
+# move the played user draws of every settled round to the archive, a round at a time. Rounds still being settled
+# are left alone. Yields the number of draws moved from each round once they are deleted from the draws table.
+def archive_played_rounds(archive):
+    unsettled_rounds = {row.lottery_round for row in Settlement.query.filter_by(completed=False)}
+    played_rounds = [row.lottery_round for row in played_rounds_query()]
+
+    for lottery_round in played_rounds:
+        if lottery_round in unsettled_rounds:
+            continue
+
+        played_draws = played_draws_query(lottery_round)
+
+        if archive.record(lottery_round) is None:
+            archive_round(archive, lottery_round, played_draws)
+
+        # the draws are only deleted once their round is in the archive
+        archived = played_draws.delete(synchronize_session=False)
+        db.session.commit()
+        yield archived
+
+
+# number of played user draws of the settled rounds, the draws archive_played_rounds moves
+def archivable_draws():
+    unsettled_rounds = Settlement.query.filter_by(completed=False).with_entities(Settlement.lottery_round)
+    return db.session.query(func.count(Draw.id)) \
+        .filter(Draw.master_draw == False, Draw.been_played == True, Draw.lottery_round.notin_(unsettled_rounds)) \
+        .scalar()
+
+
+# rounds with played user draws still in the draws table, and the played user draws of a round (also checked by
+# tests/test_query_plans.py)
+def played_rounds_query():
+    return db.session.query(Draw.lottery_round) \
+        .filter(Draw.master_draw == False, Draw.been_played == True) \
+        .distinct() \
+        .order_by(Draw.lottery_round)
+
+
+def played_draws_query(lottery_round):
+    return Draw.query.filter(Draw.master_draw == False, Draw.been_played == True, Draw.lottery_round == lottery_round)
+
+
+# decrypt the played draws of a round to masks and append them to the archive. The round is sorted by user when it is
+# appended, so its columns are numpy arrays sized by the number of draws, filled ARCHIVE_BATCH_SIZE draws at a time
+# (the round is settled, so no draw is added to it after it is counted).
+def archive_round(archive, lottery_round, played_draws):
+    draws = played_draws.count()
+    columns = {name: np.empty(draws, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+    query = played_draws.outerjoin(User, User.id == Draw.user_id) \
+        .with_entities(Draw.id, Draw.user_id, Draw.numbers, Draw.match_count, User.draw_key)
+    rows = db.session.execute(query.statement.execution_options(yield_per=ARCHIVE_BATCH_SIZE))
+
+    archived = 0
+    for batch in rows.partitions():
+        end = archived + len(batch)
+        columns['draw_id'][archived:end] = [row.id for row in batch]
+        columns['user_id'][archived:end] = [row.user_id for row in batch]
+        # draws of deleted users can no longer be decrypted, their numbers are archived as 0
+        columns['mask'][archived:end] = [plaintext_mask(fernet(row.draw_key).decrypt(row.numbers))
+                                         if row.draw_key else 0 for row in batch]
+        columns['match_count'][archived:end] = [row.match_count for row in batch]
+        archived = end
+
+    settlement = Settlement.query.filter_by(lottery_round=lottery_round).first()
+    winning_mask = settlement.winning_mask if settlement is not None and settlement.winning_mask else 0
+
+    archive.append(lottery_round, winning_mask, columns['draw_id'][:archived], columns['user_id'][:archived],
+                   columns['mask'][:archived], columns['match_count'][:archived])
@@ -0,0 +1,110 @@
+# Reading and validating submitted draws, and the format their numbers are encrypted in
+# IMPORTS
+import csv
+import io
+import struct
+
+# CONFIG
+DRAW_SIZE = 6
+LOWEST_NUMBER = 1
+HIGHEST_NUMBER = 60
+
+# Draws are encrypted as the PACKED_DRAW format marker followed by the 8-byte little-endian mask of their numbers
+# (bit n - 1 is set for number n). Draws stored before the packed format hold their numbers as text
+# ("1 2 3 4 5 6 "), which starts with a digit or a space, so the first byte tells the formats apart.
+PACKED_DRAW = b'\x01'
+DRAW_MASK = struct.Struct('<Q')
+
+
+# FUNCTIONS
+# check a draw given as a list of numbers or a "1 2 3 4 5 6" string, returns its numbers sorted.
+# Raises ValueError with the reason if the draw is invalid.
+def parse_draw(values):
+    if isinstance(values, str):
+        values = values.replace(',', ' ').split()
+
+    if not isinstance(values, (list, tuple)) or len(values) != DRAW_SIZE:
+        raise ValueError('A draw must have %d numbers' % DRAW_SIZE)
+
+    try:
+        numbers = [int(value) for value in values]
+    except (TypeError, ValueError):
+        raise ValueError('The draw numbers should be integers')
+
+    if any(number < LOWEST_NUMBER or number > HIGHEST_NUMBER for number in numbers):
+        raise ValueError('The draw numbers must be between %d and %d' % (LOWEST_NUMBER, HIGHEST_NUMBER))
+
+    if len(set(numbers)) != DRAW_SIZE:
+        raise ValueError('The draw numbers must all be different')
+
+    return sorted(numbers)
+
+
+# numbers of a draw as shown ("1 2 3 4 5 6")
+def draw_string(numbers):
+    return ' '.join(str(number) for number in numbers)
+
+
+# mask of draw numbers, and the sorted numbers of a mask
+def numbers_mask(numbers):
+    mask = 0
+    for number in numbers:
+        mask |= 1 << (int(number) - 1)
+    return mask
+
+
+def mask_numbers(mask):
+    mask = int(mask)
+    return [bit + 1 for bit in range(mask.bit_length()) if mask >> bit & 1]
+
+
+# plaintext a draw ("1 2 3 4 5 6" or a list of numbers) is encrypted as
+def pack_draw(numbers):
+    if isinstance(numbers, str):
+        numbers = numbers.split()
+    return PACKED_DRAW + DRAW_MASK.pack(numbers_mask(numbers))
+
+
+def is_packed(plaintext):
+    return plaintext[:1] == PACKED_DRAW
+
+
+# mask of a decrypted draw, packed or stored as text
+def plaintext_mask(plaintext):
+    if is_packed(plaintext):
+        return DRAW_MASK.unpack_from(plaintext, 1)[0]
+    return numbers_mask(plaintext.split())
+
+
+# numbers of a decrypted draw, packed or stored as text, as a sorted "1 2 3 4 5 6" string
+def unpack_draw(plaintext):
+    return draw_string(mask_numbers(plaintext_mask(plaintext)))
+
+
+# draws of a JSON array, each draw a list of numbers, a string or an object with a numbers field
+def read_json_draws(data):
+    if not isinstance(data, list):
+        raise ValueError('Draws must be sent as a JSON array')
+
+    return [item.get('numbers') if isinstance(item, dict) else item for item in data]
+
+
+# draws of an uploaded CSV file, one draw of 6 numbers per row (blank rows are skipped)
+def read_csv_draws(stream):
+    rows = csv.reader(io.TextIOWrapper(stream, encoding='utf-8'))
+    return [row for row in rows if any(field.strip() for field in row)]
+
+
+# check every draw in one pass, returns the numbers of the valid draws and the errors of the others by row number
+# (counting from 1)
+def validate_draws(items):
+    draws = []
+    errors = []
+
+    for row, values in enumerate(items, start=1):
+        try:
+            draws.append(parse_draw(values))
+        except ValueError as error:
+            errors.append({'row': row, 'error': str(error)})
+
+    return draws, errors
@@ -0,0 +1,53 @@
+# Server side lucky dip. Draws are picked as uniformly random indexes into the C(60, 6) sorted combinations of
+# numbers, using the operating system's cryptographically secure random source, and turned into their numbers
+# for a whole batch at once with the combinatorial number system.
+# IMPORTS
+import os
+from math import comb
+
+import numpy as np
+
+from lottery.draws import DRAW_SIZE, LOWEST_NUMBER, HIGHEST_NUMBER
+
+# CONFIG
+NUMBERS = HIGHEST_NUMBER - LOWEST_NUMBER + 1
+COMBINATIONS = comb(NUMBERS, DRAW_SIZE)
+
+# BINOMIALS[k][c] = C(c, k), increasing in c for every k
+BINOMIALS = np.array([[comb(c, k) for c in range(NUMBERS)] for k in range(DRAW_SIZE + 1)], dtype=np.int64)
+
+# random 64-bit values at or above this limit are redrawn, so taking them modulo COMBINATIONS is unbiased
+UNBIASED_LIMIT = (2 ** 64 // COMBINATIONS) * COMBINATIONS
+
+
+# FUNCTIONS
+# count uniformly random combination indexes from the operating system's secure random source
+def random_indexes(count):
+    indexes = np.empty(0, dtype=np.uint64)
+
+    while len(indexes) < count:
+        needed = count - len(indexes)
+        values = np.frombuffer(os.urandom(8 * needed), dtype=np.uint64)
+        values = values[values < np.uint64(UNBIASED_LIMIT)]
+        indexes = np.concatenate([indexes, values % np.uint64(COMBINATIONS)])
+
+    return indexes.astype(np.int64)
+
+
+# the sorted draws with the given combination indexes, one row of DRAW_SIZE numbers per index
+def unrank(indexes):
+    remaining = indexes.copy()
+    draws = np.empty((len(indexes), DRAW_SIZE), dtype=np.uint8)
+
+    # the largest c with C(c, k) <= remaining gives each number from the highest down
+    for k in range(DRAW_SIZE, 0, -1):
+        c = np.searchsorted(BINOMIALS[k], remaining, side='right') - 1
+        remaining -= BINOMIALS[k][c]
+        draws[:, k - 1] = c + LOWEST_NUMBER
+
+    return draws
+
+
+# count random draws of DRAW_SIZE different numbers, each sorted, as an array with one draw per row
+def lucky_dips(count):
+    return unrank(random_indexes(count))
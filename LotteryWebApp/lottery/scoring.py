@@ -0,0 +1,102 @@
+# Scores lottery draws as 64-bit masks, bit (n - 1) is set when number n (1 to 60) is in the draw
+# IMPORTS
+from functools import lru_cache, partial
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from draw_keys import draw_fernet
+from lottery.draws import HIGHEST_NUMBER, draw_string, mask_numbers, numbers_mask, plaintext_mask
+
+# CONFIG
+# number of matching numbers needed to win each prize tier
+PRIZE_TIERS = (3, 4, 5, 6)
+
+
+# FUNCTIONS
+# convert draw numbers ("1 2 3 4 5 6") to a mask
+def to_mask(data):
+    return numbers_mask(data.split())
+
+
+# convert a mask back to draw numbers ("1 2 3 4 5 6")
+def to_numbers(mask):
+    return draw_string(mask_numbers(mask))
+
+
+# number of set bits in every mask
+def popcount(masks):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(masks)
+
+    # numpy < 2.0 has no popcount, so count the bits in parallel within each mask instead
+    masks = masks - ((masks >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    masks = (masks & np.uint64(0x3333333333333333)) + ((masks >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    masks = (masks + (masks >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((masks * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.uint8)
+
+
+# number of matching numbers of every draw mask with the winning draw mask
+def score(masks, winning_mask):
+    return popcount(masks & np.uint64(winning_mask))
+
+
+# number of draws containing each number, index 0 is number 1
+def number_counts(masks):
+    bits = np.unpackbits(masks.astype('<u8').view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    return bits[:, :HIGHEST_NUMBER].sum(axis=0, dtype=np.int64)
+
+
+# number of draws in every prize tier
+def tier_counts(matches):
+    counts = np.bincount(matches, minlength=PRIZE_TIERS[-1] + 1)
+    return {tier: int(counts[tier]) for tier in PRIZE_TIERS}
+
+
+# PARALLEL SCORING
+# unplayed user draws in an id range, with the draw_key of their owners
+CHUNK_QUERY = text('SELECT draws.id, draws.numbers, users.draw_key FROM draws '
+                   'JOIN users ON users.id = draws.user_id '
+                   'WHERE draws.master_draw = 0 AND draws.been_played = 0 '
+                   'AND draws.id >= :first_id AND draws.id <= :last_id')
+
+
+# one engine and one Fernet per key in each worker process
+@lru_cache(maxsize=None)
+def chunk_engine(database_uri):
+    return create_engine(database_uri)
+
+
+@lru_cache(maxsize=1024)
+def chunk_fernet(draw_key):
+    return draw_fernet(draw_key)
+
+
+# decrypt and score the unplayed user draws with ids from first_id to last_id, runs in a worker process.
+# Returns the ids and match counts of the draws winning a prize and the number of draws containing each number.
+def score_chunk(database_uri, winning_mask, first_id, last_id):
+    with chunk_engine(database_uri).connect() as connection:
+        rows = connection.execute(CHUNK_QUERY, {'first_id': first_id, 'last_id': last_id}).all()
+
+    ids = np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+    masks = np.fromiter((plaintext_mask(chunk_fernet(row.draw_key).decrypt(row.numbers)) for row in rows),
+                        dtype=np.uint64, count=len(rows))
+
+    match_counts = score(masks, winning_mask)
+    prize_winners = match_counts >= PRIZE_TIERS[0]
+    return ids[prize_winners], match_counts[prize_winners], number_counts(masks)
+
+
+# split the unplayed user draws with ids from first_id to last_id into chunks of chunk_size ids and score them
+# in a pool of worker processes. Returns the ids and match counts of the draws winning a prize and the number of
+# draws containing each number.
+def score_parallel(executor, database_uri, winning_mask, first_id, last_id, chunk_size):
+    chunks = [(chunk_first_id, min(chunk_first_id + chunk_size - 1, last_id))
+              for chunk_first_id in range(first_id, last_id + 1, chunk_size)]
+
+    results = list(executor.map(partial(score_chunk, database_uri, winning_mask),
+                                [chunk[0] for chunk in chunks], [chunk[1] for chunk in chunks]))
+
+    return (np.concatenate([ids for ids, _, _ in results] or [np.empty(0, dtype=np.int64)]),
+            np.concatenate([match_counts for _, match_counts, _ in results] or [np.empty(0, dtype=np.uint8)]),
+            sum((counts for _, _, counts in results), np.zeros(HIGHEST_NUMBER, dtype=np.int64)))
@@ -0,0 +1,68 @@
+# Lottery statistics across rounds. Every settlement keeps the statistics of its round (tickets, players, draws in
+# each prize tier and the number of draws containing each number), so queries read one row per round and never
+# touch or decrypt the draws themselves.
+# IMPORTS
+import numpy as np
+
+from lottery import scoring
+from lottery.draws import HIGHEST_NUMBER
+from models import Settlement
+
+# CONFIG
+# numbers listed as hot (most drawn) and cold (least drawn)
+HOT_NUMBERS = 6
+
+
+# FUNCTIONS
+# settled rounds from first_round to last_round (all rounds if None)
+def settled_rounds(first_round=None, last_round=None):
+    query = Settlement.query.filter_by(completed=True)
+
+    if first_round is not None:
+        query = query.filter(Settlement.lottery_round >= first_round)
+    if last_round is not None:
+        query = query.filter(Settlement.lottery_round <= last_round)
+
+    return query.order_by(Settlement.lottery_round).all()
+
+
+# statistics of every settled round from first_round to last_round, and of the numbers drawn across them
+def round_statistics(first_round=None, last_round=None):
+    number_counts = np.zeros(HIGHEST_NUMBER, dtype=np.int64)
+    tiers = dict.fromkeys(scoring.PRIZE_TIERS, 0)
+    rounds = []
+    counted_tickets = 0
+
+    for settlement in settled_rounds(first_round, last_round):
+        round_tiers = settlement.tier_counts()
+        rounds.append({'lottery_round': settlement.lottery_round,
+                       'tickets': settlement.draws_settled,
+                       'players': settlement.players,
+                       'tiers': round_tiers,
+                       'winners': sum(round_tiers.values()),
+                       'winning_numbers': scoring.to_numbers(settlement.winning_mask or 0) or None})
+
+        for tier, count in round_tiers.items():
+            tiers[tier] += count
+
+        # rounds settled before statistics were kept have no number counts
+        if settlement.number_counts is not None:
+            number_counts += settlement.number_count_array()
+            counted_tickets += settlement.draws_settled
+
+    numbers = [{'number': number + 1,
+                'count': int(count),
+                'share': int(count) / counted_tickets if counted_tickets else 0.0}
+               for number, count in enumerate(number_counts)]
+
+    # most and least drawn numbers, ties go to the lowest number
+    most_drawn = np.argsort(-number_counts, kind='stable')
+    least_drawn = np.argsort(number_counts, kind='stable')
+
+    return {'rounds': rounds,
+            'tickets': sum(row['tickets'] for row in rounds),
+            'mean_players': sum(row['players'] for row in rounds) / len(rounds) if rounds else 0.0,
+            'tiers': tiers,
+            'numbers': numbers,
+            'hot': [int(number) + 1 for number in most_drawn[:HOT_NUMBERS]] if counted_tickets else [],
+            'cold': [int(number) + 1 for number in least_drawn[:HOT_NUMBERS]] if counted_tickets else []}
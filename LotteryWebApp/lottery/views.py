@@ -1,10 +1,18 @@
 # IMPORTS
 import logging
 
-from flask import Blueprint, render_template, request, flash
+from flask import Blueprint, render_template, request, flash, jsonify, current_app
+from flask_login import current_user, login_required
 
-from app import db
-from models import Draw
+from app import requires_roles
+from extensions import db
+from lottery.draws import DRAW_SIZE, parse_draw, draw_string, read_json_draws, read_csv_draws, validate_draws
+from models import Draw, decrypt_many, insert_draws
+from page_cache import render_cached
+from pagination import keyset_page, page_size, wants_json
+
+# lucky dips and the archive use numpy and are imported by the views using them, so workers start without loading
+# numpy until one is used
 
 # CONFIG
 lottery_blueprint = Blueprint('lottery', __name__, template_folder='templates')
@@ -14,18 +22,23 @@ lottery_blueprint = Blueprint('lottery', __name__, template_folder='templates')
 # view lottery page
 @lottery_blueprint.route('/lottery')
 def lottery():
-    return render_template('lottery/lottery.html')
+    return render_cached('lottery.html', tables=('draws',))
 
 
 @lottery_blueprint.route('/add_draw', methods=['POST'])
+@login_required
 def add_draw():
-    submitted_draw = ''
-    for i in range(6):
-        submitted_draw += request.form.get('no' + str(i + 1)) + ' '
-    submitted_draw.strip()
+    try:
+        numbers = parse_draw([request.form.get('no' + str(i + 1)) for i in range(DRAW_SIZE)])
+    except ValueError as error:
+        flash(str(error))
+        return lottery()
+
+    submitted_draw = draw_string(numbers)
 
     # create a new draw with the form data.
-    new_draw = Draw(user_id=1, numbers=submitted_draw, master_draw=False, lottery_round=0)  # TODO: update user_id [user_id=1 is a placeholder]
+    new_draw = Draw(user_id=current_user.id, numbers=submitted_draw, master_draw=False, lottery_round=0,
+                    draw_key=current_user.draw_key)
 
     # add the new draw to the database
     db.session.add(new_draw)
@@ -36,30 +49,87 @@ def add_draw():
     return lottery()
 
 
-# view all draws that have not been played
+# submit many draws at once, as a JSON array or an uploaded CSV file (field "draws") with one draw per row.
+# lucky_dip=N adds N lucky dip draws to the submission (or makes up the whole submission).
+@lottery_blueprint.route('/add_draws', methods=['POST'])
+@login_required
+def add_draws():
+    lucky_dip_count = request.args.get('lucky_dip', 0, type=int)
+
+    try:
+        if request.is_json:
+            items = read_json_draws(request.get_json())
+        elif 'draws' in request.files:
+            items = read_csv_draws(request.files['draws'].stream)
+        elif lucky_dip_count > 0:
+            items = []
+        else:
+            return jsonify(error='Send draws as a JSON array or a CSV file'), 400
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+
+    if len(items) + max(lucky_dip_count, 0) > current_app.config['BULK_DRAW_LIMIT']:
+        return jsonify(error='At most %d draws can be submitted at once' % current_app.config['BULK_DRAW_LIMIT']), 413
+
+    # validate every draw, then encrypt and insert the valid ones together with any lucky dip draws
+    draws, errors = validate_draws(items)
+    if lucky_dip_count > 0:
+        from lottery.lucky_dip import lucky_dips
+        draws.extend(lucky_dips(lucky_dip_count).tolist())
+
+    if draws:
+        insert_draws(current_user.id, [draw_string(numbers) for numbers in draws], current_user.draw_key)
+
+    return jsonify(submitted=len(draws), errors=errors)
+
+
+# generate lucky dip draws on the server (count draws, up to LUCKY_DIP_LIMIT)
+@lottery_blueprint.route('/lucky_dip', methods=['GET', 'POST'])
+@login_required
+def lucky_dip():
+    count = request.values.get('count', 1, type=int)
+
+    if count < 1 or count > current_app.config['LUCKY_DIP_LIMIT']:
+        return jsonify(error='Between 1 and %d lucky dip draws can be generated at once'
+                             % current_app.config['LUCKY_DIP_LIMIT']), 400
+
+    from lottery.lucky_dip import lucky_dips
+
+    return jsonify(draws=lucky_dips(count).tolist())
+
+
+# view all draws that have not been played, a page at a time
 @lottery_blueprint.route('/view_draws', methods=['POST'])
+@login_required
 def view_draws():
-    # get all draws that have not been played [played=0]
-    playable_draws = Draw.query.filter_by(been_played=False).all()  # TODO: filter playable draws for current user
+    # get a page of the current user's draws that have not been played [played=0]
+    playable_draws, next_cursor = keyset_page(user_draws_query(current_user.id, False), Draw.id)
+
+    if wants_json():
+        return jsonify(draws=draws_json(playable_draws), next_cursor=next_cursor)
 
     # if playable draws exist
     if len(playable_draws) != 0:
         # re-render lottery page with playable draws
-        return render_template('lottery/lottery.html', playable_draws=playable_draws)
+        return render_template('lottery.html', playable_draws=playable_draws, next_cursor=next_cursor)
     else:
         flash('No playable draws.')
         return lottery()
 
 
-# view lottery results
+# view lottery results, a page at a time
 @lottery_blueprint.route('/check_draws', methods=['POST'])
+@login_required
 def check_draws():
-    # get played draws
-    played_draws = Draw.query.filter_by(been_played=True).all()  # TODO: filter played draws for current user
+    # get a page of the current user's played draws
+    played_draws, next_cursor = keyset_page(user_draws_query(current_user.id, True), Draw.id)
+
+    if wants_json():
+        return jsonify(draws=draws_json(played_draws), next_cursor=next_cursor)
 
     # if played draws exist
     if len(played_draws) != 0:
-        return render_template('lottery/lottery.html', results=played_draws, played=True)
+        return render_template('lottery.html', results=played_draws, played=True, next_cursor=next_cursor)
 
     # if no played draws exist [all draw entries have been played therefore wait for next lottery round]
     else:
@@ -67,13 +137,52 @@ def check_draws():
         return lottery()
 
 
-# delete all played draws
+# draws of the current user as JSON, with their decrypted numbers
+def draws_json(draws):
+    return [{'id': draw.id,
+             'numbers': numbers,
+             'lottery_round': draw.lottery_round,
+             'been_played': draw.been_played,
+             'matches_master': draw.matches_master,
+             'match_count': draw.match_count}
+            for draw, numbers in zip(draws, decrypt_many(draws, current_user.draw_key))]
+
+
+# move all played draws of settled rounds to the archive, in a background job
 @lottery_blueprint.route('/play_again', methods=['POST'])
+@login_required
+@requires_roles('user')
 def play_again():
-    Draw.query.filter_by(been_played=True, master_draw=False).delete(synchronize_session=False)
-    db.session.commit()
+    from admin.jobs import submit_archive
+
+    job = submit_archive()
+
+    flash("Played draws are being archived (job %s)." % job.id)
+    return lottery()
+
+
+# view the current user's draws in archived rounds, newest round first, a page of rounds at a time
+@lottery_blueprint.route('/draw_history', methods=['POST'])
+@login_required
+def draw_history():
+    from lottery.archive import round_archive
+
+    history, next_round = round_archive(current_app).user_history(current_user.id,
+                                                                  request.values.get('before_round', type=int),
+                                                                  page_size())
+
+    if wants_json():
+        return jsonify(draws=history, next_round=next_round)
+
+    if history:
+        return render_template('lottery.html', history=history, next_round=next_round)
 
-    flash("All played draws deleted.")
+    flash('No archived draws.')
     return lottery()
 
 
+# QUERIES
+# built here so tests/test_query_plans.py checks the same queries as the views run
+# the playable (played=False) or played draws of a user, listed a page at a time
+def user_draws_query(user_id, played):
+    return Draw.query.filter_by(been_played=played, user_id=user_id)
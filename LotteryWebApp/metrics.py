@@ -0,0 +1,369 @@
+# Request profiling. Every request records its wall time, the number of SQL queries and the time spent in SQL,
+# in encryption (models.encrypt/decrypt) and in rendering templates. The samples are kept per endpoint in histograms,
+# in total since the process started (for Prometheus) and over the last METRICS_WINDOW seconds (for the admin
+# metrics page). A sample of requests can also be run under cProfile, the sample rate can be changed at runtime.
+# IMPORTS
+import cProfile
+import hmac
+import pstats
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+
+# CONFIG
+# upper bounds of the histogram buckets of times (seconds) and query counts
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# what is measured for every request, with the buckets, Prometheus name and help text of its histogram
+MEASURES = {
+    'wall': (SECONDS_BUCKETS, 'lottery_request_seconds', 'Wall time of requests in seconds'),
+    'queries': (QUERY_BUCKETS, 'lottery_request_sql_queries', 'SQL queries run by requests'),
+    'sql': (SECONDS_BUCKETS, 'lottery_request_sql_seconds', 'Time requests spent running SQL queries in seconds'),
+    'crypto': (SECONDS_BUCKETS, 'lottery_request_crypto_seconds',
+               'Time requests spent encrypting and decrypting draws in seconds'),
+    'template': (SECONDS_BUCKETS, 'lottery_request_template_seconds',
+                 'Time requests spent rendering templates in seconds'),
+}
+
+# counters reported for every cache registered with register_cache, with the Prometheus name, type and help text of
+# each (a cache reports the counters it keeps)
+CACHE_MEASURES = {
+    'hits': ('lottery_cache_hits_total', 'counter', 'Cache lookups answered from the cache'),
+    'misses': ('lottery_cache_misses_total', 'counter', 'Cache lookups not answered from the cache'),
+    'invalidations': ('lottery_cache_invalidations_total', 'counter', 'Cache entries dropped as out of date'),
+    'size': ('lottery_cache_entries', 'gauge', 'Entries in the cache'),
+    'bytes': ('lottery_cache_bytes', 'gauge', 'Bytes held by the cache'),
+}
+
+# the rolling window is kept as this many slices, the oldest slice is dropped as a new one starts
+WINDOW_SLICES = 10
+
+
+# CLASSES
+class Histogram:
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.total += other.total
+        self.count += other.count
+
+    # estimate of the q quantile, the upper bound of the bucket it falls in
+    def quantile(self, q):
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.bounds[min(i, len(self.bounds) - 1)]
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class RollingHistogram:
+
+    def __init__(self, bounds, window):
+        self.bounds = bounds
+        self.slice_seconds = window / WINDOW_SLICES
+        self.slices = deque()
+
+    def observe(self, value, now):
+        current = int(now // self.slice_seconds)
+        if not self.slices or self.slices[-1][0] != current:
+            self.slices.append((current, Histogram(self.bounds)))
+        self.slices[-1][1].observe(value)
+
+        while self.slices[0][0] <= current - WINDOW_SLICES:
+            self.slices.popleft()
+
+    # the samples of the last window merged in one histogram
+    def snapshot(self, now):
+        current = int(now // self.slice_seconds)
+        histogram = Histogram(self.bounds)
+        for index, histogram_slice in self.slices:
+            if index > current - WINDOW_SLICES:
+                histogram.merge(histogram_slice)
+        return histogram
+
+
+class RequestMetrics:
+
+    def __init__(self, window):
+        self.window = window
+        self.totals = {}
+        self.rolling = {}
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, sample):
+        now = time.monotonic()
+
+        with self.lock:
+            if endpoint not in self.totals:
+                self.totals[endpoint] = {measure: Histogram(bounds) for measure, (bounds, _, _) in MEASURES.items()}
+                self.rolling[endpoint] = {measure: RollingHistogram(bounds, self.window)
+                                          for measure, (bounds, _, _) in MEASURES.items()}
+
+            for measure, value in sample.items():
+                self.totals[endpoint][measure].observe(value)
+                self.rolling[endpoint][measure].observe(value, now)
+
+    # a row for every endpoint with requests in the last window, slowest (p99) first. Times are in milliseconds.
+    def summary(self):
+        now = time.monotonic()
+        rows = []
+
+        with self.lock:
+            for endpoint, histograms in self.rolling.items():
+                snapshot = {measure: histogram.snapshot(now) for measure, histogram in histograms.items()}
+                wall = snapshot['wall']
+                if not wall.count:
+                    continue
+
+                rows.append({'endpoint': endpoint,
+                             'requests': wall.count,
+                             'p50_ms': wall.quantile(0.5) * 1000,
+                             'p99_ms': wall.quantile(0.99) * 1000,
+                             'mean_ms': wall.mean() * 1000,
+                             'queries': snapshot['queries'].mean(),
+                             'sql_ms': snapshot['sql'].mean() * 1000,
+                             'crypto_ms': snapshot['crypto'].mean() * 1000,
+                             'template_ms': snapshot['template'].mean() * 1000})
+
+        return sorted(rows, key=lambda row: row['p99_ms'], reverse=True)
+
+    # every histogram since the process started, in the Prometheus text format
+    def prometheus(self):
+        lines = []
+
+        with self.lock:
+            for measure, (bounds, name, description) in MEASURES.items():
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s histogram' % name)
+
+                for endpoint, histograms in sorted(self.totals.items()):
+                    histogram = histograms[measure]
+                    cumulative = 0
+                    for bound, count in zip(bounds + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append('%s_bucket{endpoint="%s",le="%s"} %d' % (name, endpoint, bound, cumulative))
+                    lines.append('%s_sum{endpoint="%s"} %r' % (name, endpoint, histogram.total))
+                    lines.append('%s_count{endpoint="%s"} %d' % (name, endpoint, histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+
+class SampledProfiler:
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.stats = {}
+        self.samples = {}
+        self.lock = threading.Lock()
+        # only one request is profiled at a time, cProfile cannot profile overlapping requests
+        self.active = threading.Lock()
+
+    # a started profiler if this request is sampled, otherwise None
+    def start(self):
+        if self.rate <= 0 or random.random() >= self.rate or not self.active.acquire(blocking=False):
+            return None
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already running in this process
+            self.active.release()
+            return None
+        return profile
+
+    def stop(self, endpoint, profile):
+        profile.disable()
+        self.active.release()
+
+        with self.lock:
+            if endpoint in self.stats:
+                self.stats[endpoint].add(profile)
+            else:
+                self.stats[endpoint] = pstats.Stats(profile)
+            self.samples[endpoint] = self.samples.get(endpoint, 0) + 1
+
+    # the functions of an endpoint's sampled requests with the most cumulative time
+    def top(self, endpoint, limit=25):
+        with self.lock:
+            stats = self.stats.get(endpoint)
+            if stats is None:
+                return []
+
+            rows = [{'function': '%s:%d(%s)' % function,
+                     'calls': calls,
+                     'tottime_ms': tottime * 1000,
+                     'cumtime_ms': cumtime * 1000}
+                    for function, (_, calls, tottime, cumtime, _) in stats.stats.items()]
+
+        return sorted(rows, key=lambda row: row['cumtime_ms'], reverse=True)[:limit]
+
+    def endpoints(self):
+        with self.lock:
+            return dict(self.samples)
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.samples.clear()
+
+
+# FUNCTIONS
+# the request metrics and profiler of an app, created from its config on first use
+def request_metrics(app):
+    if 'request_metrics' not in app.extensions:
+        app.extensions['request_metrics'] = RequestMetrics(app.config['METRICS_WINDOW'])
+    return app.extensions['request_metrics']
+
+
+def profiler(app):
+    if 'profiler' not in app.extensions:
+        app.extensions['profiler'] = SampledProfiler(app.config['METRICS_PROFILE_RATE'])
+    return app.extensions['profiler']
+
+
+# report the counters of a cache with the request metrics, stats returns them as a dict (see CACHE_MEASURES)
+def register_cache(app, name, stats):
+    app.extensions.setdefault('cache_stats', {})[name] = stats
+
+
+# the counters of every cache of an app, with the hit rate of the caches counting hits and misses
+def cache_stats(app):
+    caches = {}
+    for name, stats in sorted(app.extensions.get('cache_stats', {}).items()):
+        counters = dict(stats())
+        lookups = counters.get('hits', 0) + counters.get('misses', 0)
+        counters['hit_rate'] = counters['hits'] / lookups if lookups else None
+        caches[name] = counters
+    return caches
+
+
+# the counters of every cache of an app in the Prometheus text format
+def cache_prometheus(app):
+    caches = cache_stats(app)
+    lines = []
+
+    for measure, (name, metric_type, description) in CACHE_MEASURES.items():
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+        for cache, counters in caches.items():
+            if measure in counters:
+                lines.append('%s{cache="%s"} %d' % (name, cache, counters[measure]))
+
+    return '\n'.join(lines) + '\n'
+
+
+# add the time spent in the block to a measure of the current request
+@contextmanager
+def timer(measure):
+    sample = g.get('request_metrics') if has_request_context() else None
+    if sample is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        sample[measure] += time.perf_counter() - start
+
+
+# decorator adding the time spent in a function to a measure of the current request
+def timed(measure):
+    def wrapper(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            # outside requests (settlement jobs, scripts) the function is called as it is
+            if not has_request_context():
+                return f(*args, **kwargs)
+
+            with timer(measure):
+                return f(*args, **kwargs)
+
+        return wrapped
+
+    return wrapper
+
+
+# measure every request of the app and every query run on the engine
+def register_instrumentation(app, engine):
+    @app.before_request
+    def start_request():
+        g.request_metrics = {'wall': time.perf_counter(), 'queries': 0, 'sql': 0.0, 'crypto': 0.0, 'template': 0.0}
+        g.profile = profiler(app).start()
+
+    @app.teardown_request
+    def finish_request(error=None):
+        sample = g.pop('request_metrics', None)
+        if sample is None:
+            return
+
+        sample['wall'] = time.perf_counter() - sample['wall']
+        endpoint = request.endpoint or 'unmatched'
+        request_metrics(app).record(endpoint, sample)
+
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profiler(app).stop(endpoint, profile)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query(connection, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'request_metrics' in g:
+            connection.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def finish_query(connection, cursor, statement, parameters, context, executemany):
+        starts = connection.info.get('query_start')
+        if starts and has_request_context() and 'request_metrics' in g:
+            g.request_metrics['queries'] += 1
+            g.request_metrics['sql'] += time.perf_counter() - starts.pop()
+
+    # templates rendered inside another template (fragments) are only counted once, in the outer template
+    @before_render_template.connect_via(app)
+    def start_template(sender, template, context, **extra):
+        if 'request_metrics' in g:
+            g.template_depth = g.get('template_depth', 0) + 1
+            if g.template_depth == 1:
+                g.template_start = time.perf_counter()
+
+    @template_rendered.connect_via(app)
+    def finish_template(sender, template, context, **extra):
+        if 'request_metrics' in g and g.get('template_depth'):
+            g.template_depth -= 1
+            if g.template_depth == 0:
+                g.request_metrics['template'] += time.perf_counter() - g.template_start
+
+
+# the bearer token sent by Prometheus, when METRICS_TOKEN is set. Compared in constant time so the token cannot be
+# guessed from response times.
+def valid_metrics_token():
+    token = current_app.config.get('METRICS_TOKEN')
+    return bool(token) and hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                                               ('Bearer ' + token).encode('utf-8'))
@@ -0,0 +1,119 @@
+# Brings an existing lottery.db up to date with the current models
+# run from the LotteryWebApp directory: python migrations.py [master draw key]
+# IMPORTS
+import os
+import sys
+
+from sqlalchemy import inspect, text
+
+import models
+from app import create_app
+from extensions import db
+
+
+# MIGRATIONS
+# drop the draw digest column and its index, settlement scores every draw from its numbers and never read them
+def drop_draw_digest(connection):
+    connection.execute(text('DROP INDEX IF EXISTS ix_draws_digest'))
+    columns = [column['name'] for column in inspect(connection).get_columns('draws')]
+
+    if 'digest' in columns:
+        connection.execute(text('ALTER TABLE draws DROP COLUMN digest'))
+
+
+# add the prize tier match count column to draws
+def add_draw_match_count(connection):
+    columns = [column['name'] for column in inspect(connection).get_columns('draws')]
+
+    if 'match_count' not in columns:
+        connection.execute(text('ALTER TABLE draws ADD COLUMN match_count INTEGER NOT NULL DEFAULT 0'))
+
+
+# add the settlement checkpoints table
+def add_settlements(connection):
+    models.Settlement.__table__.create(connection, checkfirst=True)
+
+
+# add the winning draw mask column to settlements
+def add_settlement_winning_mask(connection):
+    columns = [column['name'] for column in inspect(connection).get_columns('settlements')]
+
+    if 'winning_mask' not in columns:
+        connection.execute(text('ALTER TABLE settlements ADD COLUMN winning_mask BIGINT'))
+
+
+# add the round statistics columns to settlements
+def add_settlement_statistics(connection):
+    columns = [column['name'] for column in inspect(connection).get_columns('settlements')]
+
+    if 'number_counts' not in columns:
+        connection.execute(text('ALTER TABLE settlements ADD COLUMN number_counts BLOB'))
+
+    if 'players' not in columns:
+        connection.execute(text('ALTER TABLE settlements ADD COLUMN players INTEGER NOT NULL DEFAULT 0'))
+
+
+# add the background jobs table
+def add_jobs(connection):
+    models.Job.__table__.create(connection, checkfirst=True)
+
+
+# add the key rotation checkpoints table
+def add_key_rotations(connection):
+    models.KeyRotation.__table__.create(connection, checkfirst=True)
+
+
+# add the indexes of the draws and users tables
+def add_indexes(connection):
+    for table in (models.User.__table__, models.Draw.__table__):
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+# add the registration and login time columns to users
+def add_user_login_times(connection):
+    columns = [column['name'] for column in inspect(connection).get_columns('users')]
+
+    for column in ('registered_on', 'last_logged_in', 'current_logged_in'):
+        if column not in columns:
+            connection.execute(text('ALTER TABLE users ADD COLUMN %s DATETIME' % column))
+
+
+# add the data versions of the tables, shared by the page caches of every worker
+def add_table_versions(connection):
+    models.TableVersion.__table__.create(connection, checkfirst=True)
+
+
+# migrations in the order they are applied, each one must be safe to run again
+MIGRATIONS = [
+    drop_draw_digest,
+    add_draw_match_count,
+    add_settlements,
+    add_settlement_winning_mask,
+    add_settlement_statistics,
+    add_jobs,
+    add_key_rotations,
+    add_indexes,
+    add_user_login_times,
+    add_table_versions,
+]
+
+
+# FUNCTIONS
+def migrate(master_draw_key=None):
+    with db.engine.begin() as connection:
+        for migration in MIGRATIONS:
+            migration(connection)
+
+    # re-encrypt draws stored as text in the packed format
+    models.repack_draws(master_draw_key)
+
+
+# the draw key of the admin who created the master draws is given as the argument or in MASTER_DRAW_KEY, without it
+# master draws are left unpacked
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        sys.exit('usage: python migrations.py [master draw key]')
+
+    with create_app().app_context():
+        migrate(sys.argv[1] if len(sys.argv) == 2 else os.getenv('MASTER_DRAW_KEY'))
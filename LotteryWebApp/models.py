@@ -1,105 +1,354 @@
-import base64
+import json
 from datetime import datetime
+from functools import lru_cache
 
-import form as form
-import pyotp
 from flask_login import UserMixin
-import app
-import bcrypt
-from cryptography.fernet import Fernet
+from sqlalchemy import bindparam, insert, update
 from werkzeug.security import generate_password_hash
 
+from draw_keys import draw_fernet, new_key
+from extensions import db
+from lottery.draws import HIGHEST_NUMBER, is_packed, pack_draw, plaintext_mask, unpack_draw
+from metrics import timed, timer
+
 
 # Encryption
+# Fernet instances are cached per draw_key so decrypting many draws does not set up the key every time. A draw_key
+# being rotated holds the new and the old key (see draw_keys) and gets a MultiFernet reading with either.
+FERNET_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=FERNET_CACHE_SIZE)
+def fernet(draw_key):
+    return draw_fernet(draw_key)
+
+
+# Fernet cache hits, misses and size, as reported on the metrics page
+def fernet_cache_info():
+    info = fernet.cache_info()
+    return {'size': info.currsize, 'hits': info.hits, 'misses': info.misses}
+
+
+# Draw numbers are encrypted packed into a mask (see lottery.draws) and decrypted to a "1 2 3 4 5 6" string, or
+# straight to the mask for matching
+@timed('crypto')
 def encrypt(data, draw_key):
-    return Fernet(draw_key).encrypt(bytes(data, 'utf-8'))
+    return fernet(draw_key).encrypt(pack_draw(data))
 
 
+@timed('crypto')
 def decrypt(data, draw_key):
-    return Fernet(draw_key).decrypt(data).decode("utf-8")
+    return unpack_draw(fernet(draw_key).decrypt(data))
+
+
+@timed('crypto')
+def decrypt_mask(data, draw_key):
+    return plaintext_mask(fernet(draw_key).decrypt(data))
+
 
+# Decrypt the numbers of a list of draws encrypted with the same draw_key
+@timed('crypto')
+def decrypt_many(rows, draw_key):
+    f = fernet(draw_key)
+    return [unpack_draw(f.decrypt(row.numbers)) for row in rows]
 
-class User(app.db.Model, UserMixin):
+
+class User(db.Model, UserMixin):
     __tablename__ = 'users'
+    __table_args__ = (
+        # admins list users by role
+        db.Index('ix_users_role', 'role'),
+    )
 
-    id = app.db.Column(app.db.Integer, primary_key=True)
+    id = db.Column(db.Integer, primary_key=True)
 
     # User authentication information.
-    email = app.db.Column(app.db.String(100), nullable=False, unique=True)
-    password = app.db.Column(app.db.String(100), nullable=False)
-    pin_key = app.db.Column(app.db.String(100), nullable=False)
+    email = db.Column(db.String(100), nullable=False, unique=True)
+    password = db.Column(db.String(100), nullable=False)
+    pin_key = db.Column(db.String(100), nullable=False)
 
     # User information
-    firstname = app.db.Column(app.db.String(100), nullable=False)
-    lastname = app.db.Column(app.db.String(100), nullable=False)
-    phone = app.db.Column(app.db.String(100), nullable=False)
-    role = app.db.Column(app.db.String(100), nullable=False, default='user')
-    postkey = app.db.Column(app.db.BLOB)
+    firstname = db.Column(db.String(100), nullable=False)
+    lastname = db.Column(db.String(100), nullable=False)
+    phone = db.Column(db.String(100), nullable=False)
+    role = db.Column(db.String(100), nullable=False, default='user')
+    postkey = db.deferred(db.Column(db.BLOB))
+
+    # Crypto key for user's lottery draws (deferred like postkey, so the BLOBs are only loaded when used)
+    draw_key = db.deferred(db.Column(db.BLOB))
 
-    # Crypto key for user's lottery draws
-    draw_key = app.db.Column(app.db.BLOB)
+    # When the user registered, and when they logged in before the current and in the current session
+    registered_on = db.Column(db.DateTime)
+    last_logged_in = db.Column(db.DateTime)
+    current_logged_in = db.Column(db.DateTime)
 
     # Define the relationship to Draw
-    draws = app.db.relationship('Draw')
+    draws = db.relationship('Draw')
 
-    def __init__(self, email, firstname, lastname, phone, password, role, pin_key=form.pin_key):
+    def __init__(self, email, firstname, lastname, phone, password, role, pin_key=None):
         self.email = email
         self.firstname = firstname
         self.lastname = lastname
         self.phone = phone
-        self.password = bcrypt.hashpw(User.password.encode('utf-8'), bcrypt.gensalt())
+        # hashed the way users.views.login checks it
+        self.password = generate_password_hash(password)
         self.role = role
-        self.draw_key = base64.urlsafe_b64encode(bcrypt)
-        self.postkey = Fernet.generate_key()
-        self.pin_key = pyotp.random_base32()
+        self.draw_key = new_key()
+        self.postkey = new_key()
+        if pin_key is None:
+            import pyotp
+            pin_key = pyotp.random_base32()
+        self.pin_key = pin_key
         self.registered_on = datetime.now()
         self.last_logged_in = None
         self.current_logged_in = None
 
 
-class Draw(app.db.Model):
+class Draw(db.Model):
     __tablename__ = 'draws'
+    __table_args__ = (
+        # winning draw lookups and settlement of unplayed user draws by id range
+        db.Index('ix_draws_master_draw_been_played', 'master_draw', 'been_played'),
+        # playable and played draw listings of each user
+        db.Index('ix_draws_been_played_user_id', 'been_played', 'user_id'),
+        # winners of a lottery round
+        db.Index('ix_draws_lottery_round_matches_master', 'lottery_round', 'matches_master'),
+        # played user draws of a lottery round, counted for the round statistics and moved to the archive
+        db.Index('ix_draws_master_draw_been_played_lottery_round', 'master_draw', 'been_played', 'lottery_round'),
+    )
 
-    id = app.db.Column(app.db.Integer, primary_key=True)
+    id = db.Column(db.Integer, primary_key=True)
 
     # ID of user who submitted draw
-    user_id = app.db.Column(app.db.Integer, app.db.ForeignKey(User.id), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), nullable=False)
 
-    # 6 draw numbers submitted
-    # encrypted_data =
-    numbers = app.db.Column(app.db.String(100), nullable=False)
+    # 6 draw numbers submitted, packed and encrypted (a 100 character Fernet token)
+    numbers = db.Column(db.String(100), nullable=False)
 
     # Draw has already been played (can only play draw once)
-    been_played = app.db.Column(app.db.BOOLEAN, nullable=False, default=False)
+    been_played = db.Column(db.BOOLEAN, nullable=False, default=False)
 
     # Draw matches with master draw created by admin (True = draw is a winner)
-    matches_master = app.db.Column(app.db.BOOLEAN, nullable=False, default=False)
+    matches_master = db.Column(db.BOOLEAN, nullable=False, default=False)
+
+    # Number of numbers matching the master draw, used for the prize tiers (0 = no prize)
+    match_count = db.Column(db.Integer, nullable=False, default=0)
 
     # True = draw is master draw created by admin. User draws are matched to master draw
-    master_draw = app.db.Column(app.db.BOOLEAN, nullable=False)
+    master_draw = db.Column(db.BOOLEAN, nullable=False)
 
     # Lottery round that draw is used
-    lottery_round = app.db.Column(app.db.Integer, nullable=False, default=0)
+    lottery_round = db.Column(db.Integer, nullable=False, default=0)
 
     def __init__(self, user_id, numbers, master_draw, lottery_round, draw_key):
         self.user_id = user_id
-        self.numbers = encrypt((numbers, draw_key))
+        self.numbers = encrypt(numbers, draw_key)
         self.been_played = False
         self.matches_master = False
+        self.match_count = 0
         self.master_draw = master_draw
         self.lottery_round = lottery_round
 
     def update_draw(self, draw, draw_key):
         self.numbers = encrypt(draw, draw_key)
-        app.db.session.commit()
+        db.session.commit()
 
     def view_draw(self, draw_key):
         return decrypt(self.numbers, draw_key)
 
 
+# Insert many draws of one user with a single executemany, committed in one transaction
+def insert_draws(user_id, draws, draw_key):
+    f = fernet(draw_key)
+    with timer('crypto'):
+        rows = [{'user_id': user_id,
+                 'numbers': f.encrypt(pack_draw(draw)),
+                 'been_played': False,
+                 'matches_master': False,
+                 'match_count': 0,
+                 'master_draw': False,
+                 'lottery_round': 0} for draw in draws]
+    db.session.execute(insert(Draw.__table__), rows)
+    db.session.commit()
+
+
+class Settlement(db.Model):
+    __tablename__ = 'settlements'
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # Lottery round being settled
+    lottery_round = db.Column(db.Integer, nullable=False, unique=True)
+
+    # ID of the last user draw in the round (draws submitted while settling wait for the next round)
+    last_draw_id = db.Column(db.Integer, nullable=False)
+
+    # ID of the last user draw settled so far, settlement resumes after it
+    checkpoint = db.Column(db.Integer, nullable=False, default=0)
+
+    # Number of draws settled and number of draws in each prize tier so far
+    draws_settled = db.Column(db.Integer, nullable=False, default=0)
+    tier_3 = db.Column(db.Integer, nullable=False, default=0)
+    tier_4 = db.Column(db.Integer, nullable=False, default=0)
+    tier_5 = db.Column(db.Integer, nullable=False, default=0)
+    tier_6 = db.Column(db.Integer, nullable=False, default=0)
+
+    # True = every draw in the round has been settled
+    completed = db.Column(db.BOOLEAN, nullable=False, default=False)
+
+    # Mask of the winning draw numbers (see lottery.scoring), kept with the round's results in the archive
+    winning_mask = db.Column(db.BigInteger)
+
+    # Round statistics: number of draws containing each number (60 little-endian 64-bit counts) and number of users
+    # with draws in the round
+    number_counts = db.Column(db.LargeBinary)
+    players = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, lottery_round, last_draw_id):
+        self.lottery_round = lottery_round
+        self.last_draw_id = last_draw_id
+        self.checkpoint = 0
+        self.draws_settled = 0
+        self.tier_3 = 0
+        self.tier_4 = 0
+        self.tier_5 = 0
+        self.tier_6 = 0
+        self.completed = False
+        self.winning_mask = None
+        self.number_counts = None
+        self.players = 0
+
+    def tier_counts(self):
+        return {3: self.tier_3, 4: self.tier_4, 5: self.tier_5, 6: self.tier_6}
+
+    def add_tier_counts(self, tier_counts):
+        for tier, count in tier_counts.items():
+            setattr(self, 'tier_%d' % tier, getattr(self, 'tier_%d' % tier) + count)
+
+    # number of draws containing each number, index 0 is number 1
+    def number_count_array(self):
+        import numpy as np
+
+        if self.number_counts is None:
+            return np.zeros(HIGHEST_NUMBER, dtype=np.int64)
+        return np.frombuffer(self.number_counts, dtype='<i8')
+
+    def add_number_counts(self, number_counts):
+        self.number_counts = (self.number_count_array() + number_counts).astype('<i8').tobytes()
+
+
+class KeyRotation(db.Model):
+    __tablename__ = 'key_rotations'
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # User whose draw_key is rotated, None for a rotation of every user's key
+    user_id = db.Column(db.Integer, index=True)
+
+    # ID of the last draw encrypted with the old key (later draws are encrypted with the new key)
+    last_draw_id = db.Column(db.Integer, nullable=False, default=0)
+
+    # ID of the last draw re-encrypted so far (ID of the last user rotated for a rotation of every user's key),
+    # rotation resumes after it
+    checkpoint = db.Column(db.Integer, nullable=False, default=0)
+
+    # Number of draws re-encrypted so far
+    draws_rotated = db.Column(db.Integer, nullable=False, default=0)
+
+    # True = every draw is re-encrypted and the old key is dropped
+    completed = db.Column(db.BOOLEAN, nullable=False, default=False)
+
+    started_on = db.Column(db.DateTime, nullable=False)
+    finished_on = db.Column(db.DateTime)
+
+    def __init__(self, user_id, last_draw_id):
+        self.user_id = user_id
+        self.last_draw_id = last_draw_id
+        self.checkpoint = 0
+        self.draws_rotated = 0
+        self.completed = False
+        self.started_on = datetime.now()
+        self.finished_on = None
+
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # Type of job (run_lottery or archive) and the lottery round it works on (0 for an archive of every round)
+    kind = db.Column(db.String(100), nullable=False)
+    lottery_round = db.Column(db.Integer, nullable=False)
+
+    # queued, running, completed or failed
+    status = db.Column(db.String(100), nullable=False, default='queued')
+
+    # Progress of the job
+    draws_total = db.Column(db.Integer, nullable=False, default=0)
+    draws_processed = db.Column(db.Integer, nullable=False, default=0)
+    winners = db.Column(db.Integer, nullable=False, default=0)
+
+    # Final results (JSON) or the error the job failed with
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+
+    created_on = db.Column(db.DateTime, nullable=False)
+    started_on = db.Column(db.DateTime)
+    updated_on = db.Column(db.DateTime)
+    finished_on = db.Column(db.DateTime)
+
+    def __init__(self, kind, lottery_round):
+        self.kind = kind
+        self.lottery_round = lottery_round
+        self.status = 'queued'
+        self.draws_total = 0
+        self.draws_processed = 0
+        self.winners = 0
+        self.created_on = datetime.now()
+
+    def progress(self):
+        progress = {'id': self.id,
+                    'kind': self.kind,
+                    'lottery_round': self.lottery_round,
+                    'status': self.status,
+                    'draws_total': self.draws_total,
+                    'draws_processed': self.draws_processed,
+                    'winners': self.winners,
+                    'rate': None,
+                    'eta_seconds': None}
+
+        # draws processed per second and estimated seconds left
+        if self.started_on and self.draws_processed:
+            elapsed = ((self.finished_on or datetime.now()) - self.started_on).total_seconds()
+            if elapsed > 0:
+                progress['rate'] = self.draws_processed / elapsed
+                progress['eta_seconds'] = (self.draws_total - self.draws_processed) / progress['rate']
+
+        if self.status == 'completed':
+            progress['result'] = json.loads(self.result)
+        elif self.status == 'failed':
+            progress['error'] = self.error
+
+        return progress
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+
+    # Table whose data version this is
+    table_name = db.Column(db.String(100), primary_key=True)
+
+    # Number of committed transactions that wrote to the table, bumped in the writing transaction (see page_cache)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.version = 0
+
+
 def init_db():
-        app.db.drop_all()
-        app.db.create_all()
+        db.drop_all()
+        db.create_all()
 
         admin = User(email='admin@email.com', firstname='Alice', lastname='Jones', phone='0191-123-4567',
                      password='Admin1!', role='admin')
@@ -107,6 +356,57 @@ def init_db():
         user = User(email='user@email.com', firstname='Bob', lastname='Billy', phone='0191-123-4567', password='User1!',
                     role='user')
 
-        app.db.session.add(admin)
-        app.db.session.add(user)
-        app.db.session.commit()
+        db.session.add(admin)
+        db.session.add(user)
+        db.session.commit()
+
+
+# Re-encrypt the draws stored as text before the packed format, packed, a batch of draws at a time. A draw is only
+# written back if it is unchanged, and draws that cannot be decrypted are left alone. Master draws have no owning
+# user, so they can only be repacked when the key of the admin who created them is given. Returns the number of
+# draws repacked.
+def repack_draws(master_draw_key=None, batch_size=1000):
+    from cryptography.fernet import InvalidToken
+
+    checkpoint = 0
+    repacked = 0
+
+    while True:
+        rows = db.session.query(Draw.id, Draw.numbers, Draw.master_draw, User.draw_key) \
+            .outerjoin(User, User.id == Draw.user_id) \
+            .filter(Draw.id > checkpoint) \
+            .order_by(Draw.id) \
+            .limit(batch_size) \
+            .all()
+
+        if not rows:
+            break
+
+        changes = []
+        for row in rows:
+            draw_key = master_draw_key if row.master_draw else row.draw_key
+            if draw_key is None:
+                continue
+
+            f = fernet(draw_key)
+            try:
+                plaintext = f.decrypt(row.numbers)
+            except InvalidToken:
+                continue
+
+            if not is_packed(plaintext):
+                changes.append({'draw_id': row.id, 'old_numbers': row.numbers,
+                                'new_numbers': f.encrypt(pack_draw(unpack_draw(plaintext)))})
+
+        if changes:
+            db.session.execute(update(Draw.__table__)
+                               .where(Draw.__table__.c.id == bindparam('draw_id'),
+                                      Draw.__table__.c.numbers == bindparam('old_numbers'))
+                               .values(numbers=bindparam('new_numbers')),
+                               changes)
+            db.session.commit()
+
+        repacked += len(changes)
+        checkpoint = rows[-1].id
+
+    return repacked
@@ -0,0 +1,187 @@
+# Cache of rendered pages and template fragments. Entries are keyed by template, user, query string and the data
+# version of the tables the page shows, so any write to those tables makes the old entries unreachable. The data
+# versions are kept in the table_versions table and bumped in the transaction writing the table, so every worker
+# sees a committed write on its next request. The cache is an LRU bounded by the total size in bytes of the cached
+# pages. Pages are sent with an ETag so repeat visits get a 304 without rendering.
+# IMPORTS
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, make_response, render_template, request, session
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import event, select
+
+from extensions import db
+
+# CONFIG
+# table written by an INSERT, UPDATE or DELETE statement
+WRITE_STATEMENT = re.compile(r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|UPDATE|DELETE\s+FROM)\s+["`]?(\w+)', re.IGNORECASE)
+
+# tables shown by the cached pages, the tables given to render_cached and cache_fragment. Only writes to these tables
+# bump a data version, writes to any other table are not seen by the page cache.
+CACHED_TABLES = frozenset(('users', 'draws'))
+
+# data versions of the tables (see models.TableVersion), bumped with an upsert as the table name may have no row yet
+VERSIONS_TABLE = 'table_versions'
+BUMP_VERSION = "INSERT INTO table_versions (table_name, version) VALUES ('%s', 1) " \
+               "ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1"
+
+
+# CLASSES
+class PageCache:
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # cached (body, etag) of key, or None
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[2] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[1]
+
+            self.misses += 1
+            return None
+
+    # cache body under key, returns (body, etag). Entries are sized by the bytes of the UTF-8 encoded body.
+    def put(self, key, body):
+        encoded = body.encode('utf-8')
+        etag = hashlib.sha1(encoded).hexdigest()
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[3]
+
+            if len(encoded) <= self.max_bytes:
+                self.entries[key] = (body, etag, time.monotonic() + self.ttl, len(encoded))
+                self.size += len(encoded)
+
+            # evict the least recently used pages until the cache fits
+            while self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][3]
+
+        return body, etag
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries),
+                    'bytes': self.size,
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+
+# FUNCTIONS
+# the page cache of an app, created from its config on first use
+def page_cache(app):
+    if 'page_cache' not in app.extensions:
+        app.extensions['page_cache'] = PageCache(app.config['PAGE_CACHE_MAX_BYTES'], app.config['PAGE_CACHE_TTL'])
+    return app.extensions['page_cache']
+
+
+# current data version of some tables, read in the request's transaction so they match the data the page shows
+def table_versions(tables):
+    if not tables:
+        return ()
+
+    # a page showing a table that is not tracked would be served stale after every write to it
+    untracked = set(tables) - CACHED_TABLES
+    if untracked:
+        raise ValueError('tables not tracked by the page cache: %s' % ', '.join(sorted(untracked)))
+
+    from models import TableVersion
+
+    versions = dict(db.session.execute(select(TableVersion.table_name, TableVersion.version)
+                                       .where(TableVersion.table_name.in_(tables))).all())
+    return tuple(versions.get(table, 0) for table in tables)
+
+
+# cache key of a template rendered for the current user and query string with the current data version of tables
+def cache_key(name, tables, context, query_string=b''):
+    user_id = current_user.get_id() if current_user else None
+    return name, user_id, query_string, table_versions(tables), tuple(sorted(context.items()))
+
+
+# render a page through the cache, tables are the tables whose data the page shows. Returns a response with an
+# ETag, or 304 Not Modified when the client already has the page.
+def render_cached(template, tables=(), **context):
+    # pages showing flashed messages are always rendered (rendering them also clears the messages)
+    if session.get('_flashes'):
+        return render_template(template, **context)
+
+    cache = page_cache(current_app)
+    key = cache_key(template, tables, context, request.query_string)
+
+    cached = cache.get(key)
+    if cached is None:
+        cached = cache.put(key, render_template(template, **context))
+
+    body, etag = cached
+    response = make_response(body)
+    response.set_etag(etag)
+
+    # browsers keep the page but check it is still current on every visit
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+    return response.make_conditional(request)
+
+
+# template global caching the output of a {% call cache_fragment(name, tables) %} ... {% endcall %} block
+def cache_fragment(name, tables=(), caller=None):
+    cache = page_cache(current_app)
+    key = cache_key('fragment:' + name, tables, {})
+
+    cached = cache.get(key)
+    if cached is None:
+        cached = cache.put(key, str(caller()))
+
+    return Markup(cached[0])
+
+
+# bump the data version of every cached table written by a transaction of the engine, once per transaction and in
+# the same transaction, so the new version is committed or rolled back together with the write. The table_versions
+# table is created if the database does not have it yet, so writes never fail on a missing table.
+def register_invalidation(engine):
+    from models import TableVersion
+
+    TableVersion.__table__.create(engine, checkfirst=True)
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def record_write(connection, cursor, statement, parameters, context, executemany):
+        match = WRITE_STATEMENT.match(statement)
+        if not match:
+            return
+
+        table = match.group(1).lower()
+        written_tables = connection.info.setdefault('written_tables', set())
+        if table not in CACHED_TABLES or table in written_tables:
+            return
+        written_tables.add(table)
+
+        # the version is bumped with a cursor of its own so the result of the write (rowcount, lastrowid) is kept.
+        # The table name is one of CACHED_TABLES.
+        version_cursor = connection.connection.cursor()
+        try:
+            version_cursor.execute(BUMP_VERSION % table)
+        finally:
+            version_cursor.close()
+
+    @event.listens_for(engine, 'commit')
+    def forget_committed_writes(connection):
+        connection.info.pop('written_tables', None)
+
+    @event.listens_for(engine, 'rollback')
+    def forget_writes(connection):
+        connection.info.pop('written_tables', None)
@@ -0,0 +1,43 @@
+# Keyset (cursor) pagination. Pages are read from an index after the id of the last row of the previous page, so
+# every page costs the same however large the table is.
+# IMPORTS
+from flask import request
+
+# CONFIG
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+# FUNCTIONS
+# page size requested by the client, limited to MAX_PAGE_SIZE
+def page_size():
+    size = request.values.get('page_size', DEFAULT_PAGE_SIZE, type=int)
+    return min(max(size, 1), MAX_PAGE_SIZE)
+
+
+# the query of one page of size rows ordered by id after cursor, reading one extra row to know if there is a next
+# page
+def keyset_query(query, id_column, cursor, size):
+    if cursor is not None:
+        query = query.filter(id_column > cursor)
+
+    return query.order_by(id_column).limit(size + 1)
+
+
+# get one page of a query ordered by id, starting after the cursor sent by the client. Returns the rows of the
+# page and the cursor of the next page (None on the last page).
+def keyset_page(query, id_column):
+    size = page_size()
+    rows = keyset_query(query, id_column, request.values.get('cursor', type=int), size).all()
+
+    if len(rows) > size:
+        rows = rows[:size]
+        return rows, rows[-1].id
+
+    return rows, None
+
+
+# True if the client asked for a JSON response instead of a page
+def wants_json():
+    return request.values.get('format') == 'json' or \
+        request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
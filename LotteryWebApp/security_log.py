@@ -0,0 +1,223 @@
+# Reading and writing the security log (lottery.log). The log rotates by size and can keep a small index next to
+# each log file (lottery.log.idx) with the offset and event type of every entry, so history can be paged back and
+# filtered without reading the log files. Records are handed to the log through a bounded queue, so filtering and
+# writing them happens on a listener thread instead of the request thread.
+# Only one process may write a log file: the offsets in the index are taken from the writing process's own file
+# position, and rotation renames the files under any other process still appending to them. Serve the app with a
+# single worker process (e.g. gunicorn --workers 1 --threads 8 "app:create_app()"); with several workers the index
+# points into the wrong entries and rotated logs lose lines.
+# IMPORTS
+import os
+import queue
+import struct
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+# CONFIG
+# event types recorded in the index, with the text identifying them in a log message
+EVENT_TYPES = {
+    'other': (0, None),
+    'login_failure': (1, 'login failed'),
+    'unauthorised_access': (2, 'unauthorised access'),
+    'login': (3, 'log in'),
+    'logout': (4, 'log out'),
+    'registration': (5, 'user registration'),
+}
+
+# index record: byte offset of the entry in the log file and its event type
+INDEX_RECORD = struct.Struct('<QB')
+
+# size of the blocks read back from the end of a file
+BLOCK_SIZE = 4096
+
+# what to do with a record when the log queue is full
+OVERFLOW_POLICIES = ('drop_newest', 'drop_oldest', 'block')
+
+
+# FUNCTIONS
+# event type code of a log message
+def event_type(message):
+    message = message.lower()
+    for code, text in EVENT_TYPES.values():
+        if text and text in message:
+            return code
+    return EVENT_TYPES['other'][0]
+
+
+def index_path(log_path):
+    return log_path + '.idx'
+
+
+# last count lines of a file, read back from the end in blocks so only the lines needed are read
+def tail(path, count=10, block_size=BLOCK_SIZE):
+    if not os.path.exists(path):
+        return []
+
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        data = b''
+
+        # one more line break than lines wanted, so the first line read is complete
+        while position > 0 and data.count(b'\n') <= count:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            data = f.read(size) + data
+
+    return data.decode('utf-8', errors='replace').splitlines()[-count:]
+
+
+# read the line starting at offset in an open log file
+def read_line(f, offset):
+    f.seek(offset)
+    return f.readline().decode('utf-8', errors='replace').rstrip('\n')
+
+
+# (offset, event type) records of an open index, newest first, read back from the end in blocks of records
+def index_records(index, last_record):
+    records_per_block = BLOCK_SIZE // INDEX_RECORD.size
+
+    while last_record >= 0:
+        first_record = max(0, last_record - records_per_block + 1)
+        index.seek(first_record * INDEX_RECORD.size)
+        block = index.read((last_record - first_record + 1) * INDEX_RECORD.size)
+        yield from reversed(list(INDEX_RECORD.iter_unpack(block)))
+        last_record = first_record - 1
+
+
+# page back through the log and its rotated backups newest first, using their indexes. skip is the number of
+# matching entries already seen (0 for the newest page) and event an EVENT_TYPES name to filter by. Returns the
+# entries of the page and the skip of the next page (None on the last page).
+def history(log_path, backup_count, count=10, skip=0, event=None):
+    event_code = EVENT_TYPES[event][0] if event else None
+    entries = []
+    matched = 0
+
+    for number in range(backup_count + 1):
+        path = log_path if number == 0 else '%s.%d' % (log_path, number)
+        if not os.path.exists(path) or not os.path.exists(index_path(path)):
+            continue
+
+        with open(index_path(path), 'rb') as index, open(path, 'rb') as log:
+            records = os.fstat(index.fileno()).st_size // INDEX_RECORD.size
+            last_record = records - 1
+
+            # without a filter, entries already seen are jumped over using the record count
+            if event_code is None:
+                skipped = max(0, min(records, skip - matched))
+                matched += skipped
+                last_record -= skipped
+
+            for offset, code in index_records(index, last_record):
+                if event_code is not None and code != event_code:
+                    continue
+
+                matched += 1
+                if matched <= skip:
+                    continue
+
+                if len(entries) == count:
+                    return entries, skip + count
+
+                entries.append(read_line(log, offset))
+
+    return entries, None
+
+
+# CLASSES
+# size rotated log file handler that can also write an index of its entries, for a log written by one process only
+class SecurityLogHandler(RotatingFileHandler):
+
+    def __init__(self, filename, max_bytes, backup_count, index=True):
+        super().__init__(filename, 'a', maxBytes=max_bytes, backupCount=backup_count)
+        self.index = index
+        self.index_stream = None
+
+    def emit(self, record):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+
+            if self.stream is None:
+                self.stream = self._open()
+
+            offset = self.stream.tell()
+            super(RotatingFileHandler, self).emit(record)
+
+            if self.index:
+                if self.index_stream is None:
+                    self.index_stream = open(index_path(self.baseFilename), 'ab')
+                self.index_stream.write(INDEX_RECORD.pack(offset, event_type(record.getMessage())))
+                self.index_stream.flush()
+        except Exception:
+            self.handleError(record)
+
+    def doRollover(self):
+        # rotate the indexes the same way as the log files
+        if self.index_stream:
+            self.index_stream.close()
+            self.index_stream = None
+
+        if self.index and self.backupCount > 0:
+            for number in range(self.backupCount - 1, 0, -1):
+                source = index_path('%s.%d' % (self.baseFilename, number))
+                if os.path.exists(source):
+                    os.replace(source, index_path('%s.%d' % (self.baseFilename, number + 1)))
+
+            if os.path.exists(index_path(self.baseFilename)):
+                os.replace(index_path(self.baseFilename), index_path(self.baseFilename + '.1'))
+
+        super().doRollover()
+
+    def close(self):
+        self.acquire()
+        try:
+            if self.index_stream:
+                self.index_stream.close()
+                self.index_stream = None
+        finally:
+            self.release()
+        super().close()
+
+
+# hands records to a bounded queue, applying the overflow policy when it is full
+class BoundedQueueHandler(QueueHandler):
+
+    def __init__(self, maxsize, overflow='drop_newest'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown log queue overflow policy: %s' % overflow)
+
+        super().__init__(queue.Queue(maxsize))
+        self.overflow = overflow
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self.overflow == 'drop_newest':
+                    return
+
+            # drop_oldest: make room by discarding the oldest queued record
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+
+
+# writes queued records to its handlers on a background thread
+class SecurityLogListener(QueueListener):
+
+    def __init__(self, queue_handler, *handlers):
+        super().__init__(queue_handler.queue, *handlers, respect_handler_level=True)
+
+    # wait for room in a full queue so stopping always writes out every queued record
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
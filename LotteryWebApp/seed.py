@@ -0,0 +1,127 @@
+# Fills the database with synthetic users and encrypted draws for benchmarking
+# run from the LotteryWebApp directory: python seed.py [users] [draws] [rounds]
+# IMPORTS
+import random
+import sys
+
+import numpy as np
+import pyotp
+from cryptography.fernet import Fernet
+from sqlalchemy import delete, insert
+from werkzeug.security import generate_password_hash
+
+import models
+from app import create_app
+from extensions import db
+from lottery import scoring
+from lottery.draws import DRAW_SIZE, LOWEST_NUMBER, HIGHEST_NUMBER, draw_string, pack_draw
+
+# CONFIG
+# every seeded account shares this password, it is hashed once since hashing is deliberately slow
+SEED_PASSWORD = 'Seed@1234'
+ADMIN_EMAIL = 'admin@email.com'
+INSERT_BATCH_SIZE = 10000
+
+
+# FUNCTIONS
+def random_draw(rng):
+    return draw_string(sorted(rng.sample(range(LOWEST_NUMBER, HIGHEST_NUMBER + 1), DRAW_SIZE)))
+
+
+def seed_user(user_id, email, role, password_hash, rng):
+    return {'id': user_id,
+            'email': email,
+            'password': password_hash,
+            'pin_key': pyotp.random_base32(),
+            'firstname': 'Seed',
+            'lastname': 'User%d' % user_id,
+            'phone': '%03d-%03d-%04d' % (rng.randrange(1000), rng.randrange(1000), rng.randrange(10000)),
+            'role': role,
+            'postkey': Fernet.generate_key(),
+            'draw_key': Fernet.generate_key()}
+
+
+# replace the users, draws and settlements with an admin, users accounts and draws spread evenly over the lottery
+# rounds. Rounds before the last are played and settled, the draws of the last round are unplayed and its winning
+# draw is waiting to be run. Returns the seeded users.
+def seed(users, draws, rounds, seed_value=None):
+    rng = random.Random(seed_value)
+
+    db.create_all()
+    for model in (models.Draw, models.Settlement, models.User):
+        db.session.execute(delete(model.__table__))
+
+    # user 1 is the admin, draws belong to the other accounts
+    password_hash = generate_password_hash(SEED_PASSWORD)
+    accounts = [seed_user(1, ADMIN_EMAIL, 'admin', password_hash, rng)]
+    accounts += [seed_user(user_id, 'user%d@email.com' % user_id, 'user', password_hash, rng)
+                 for user_id in range(2, users + 2)]
+    db.session.execute(insert(models.User.__table__), accounts)
+
+    fernets = {account['id']: models.fernet(account['draw_key']) for account in accounts}
+    user_ids = [account['id'] for account in accounts[1:]]
+    draws_per_round = -(-draws // rounds)
+    draw_id = 0
+
+    for lottery_round in range(1, rounds + 1):
+        winning_draw = random_draw(rng)
+        winning_mask = scoring.to_mask(winning_draw)
+        played = lottery_round < rounds
+        round_draws = min(draws_per_round, draws - draw_id)
+        tiers = dict.fromkeys(scoring.PRIZE_TIERS, 0)
+        number_counts = np.zeros(HIGHEST_NUMBER, dtype=np.int64)
+        players = set()
+
+        for batch_start in range(0, round_draws, INSERT_BATCH_SIZE):
+            batch, masks = [], []
+            for _ in range(min(INSERT_BATCH_SIZE, round_draws - batch_start)):
+                user_id = rng.choice(user_ids)
+                numbers = random_draw(rng)
+                masks.append(scoring.to_mask(numbers))
+                players.add(user_id)
+                matches = bin(masks[-1] & winning_mask).count('1') if played else 0
+                if matches >= scoring.PRIZE_TIERS[0]:
+                    tiers[matches] += 1
+
+                batch.append({'user_id': user_id,
+                              'numbers': fernets[user_id].encrypt(pack_draw(numbers)),
+                              'been_played': played,
+                              'matches_master': matches == DRAW_SIZE,
+                              'match_count': matches if matches >= scoring.PRIZE_TIERS[0] else 0,
+                              'master_draw': False,
+                              'lottery_round': lottery_round if played else 0})
+
+            db.session.execute(insert(models.Draw.__table__), batch)
+            number_counts += scoring.number_counts(np.array(masks, dtype=np.uint64))
+        draw_id += round_draws
+
+        if played:
+            settlement = {'lottery_round': lottery_round, 'last_draw_id': draw_id, 'checkpoint': draw_id,
+                          'draws_settled': round_draws, 'completed': True, 'winning_mask': winning_mask,
+                          'number_counts': number_counts.astype('<i8').tobytes(), 'players': len(players)}
+            settlement.update({'tier_%d' % tier: count for tier, count in tiers.items()})
+            db.session.execute(insert(models.Settlement.__table__), settlement)
+        else:
+            # the winning draw of the current round, encrypted with the admin's key like create_winning_draw does
+            db.session.execute(insert(models.Draw.__table__),
+                               {'user_id': 0,
+                                'numbers': fernets[1].encrypt(pack_draw(winning_draw)),
+                                'been_played': False,
+                                'matches_master': False,
+                                'match_count': 0,
+                                'master_draw': True,
+                                'lottery_round': lottery_round})
+
+    db.session.commit()
+    return accounts
+
+
+if __name__ == "__main__":
+    arguments = [int(argument) for argument in sys.argv[1:4]]
+    users, draws, rounds = arguments + [1000, 100000, 10][len(arguments):]
+
+    with create_app().app_context():
+        seed(users, draws, rounds)
+
+    print('Seeded %d users, %d draws over %d rounds (password %s, admin %s)'
+          % (users, draws, rounds, SEED_PASSWORD, ADMIN_EMAIL))
@@ -0,0 +1,44 @@
+# IMPORTS
+import json
+
+import seed
+from admin.jobs import run_archive
+from extensions import db
+from lottery.archive import round_archive
+from models import Draw, Job, User, decrypt_mask
+
+
+# TESTS
+def test_archive_job_moves_played_draws(app):
+    with app.app_context():
+        seed.seed(5, 300, 3, seed_value=0)
+        played = Draw.query.filter_by(master_draw=False, been_played=True).all()
+        draw_keys = dict(db.session.query(User.id, User.draw_key).all())
+        assert played
+        expected = {draw.id: (draw.user_id, decrypt_mask(draw.numbers, draw_keys[draw.user_id]), draw.match_count)
+                    for draw in played}
+
+        job = Job(kind='archive', lottery_round=0)
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+
+    run_archive(app, job_id)
+
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        assert job.status == 'completed'
+        assert json.loads(job.result) == {'archived': len(expected)}
+        assert job.draws_total == len(expected)
+        assert Draw.query.filter_by(master_draw=False, been_played=True).count() == 0
+
+        archived = {}
+        for record in round_archive(app).index():
+            columns = round_archive(app).columns(record)
+            # the rows of a round are sorted by user
+            assert list(columns['user_id']) == sorted(columns['user_id'])
+            for draw_id, user_id, mask, match_count in zip(columns['draw_id'], columns['user_id'], columns['mask'],
+                                                           columns['match_count']):
+                archived[int(draw_id)] = (int(user_id), int(mask), int(match_count))
+
+        assert archived == expected
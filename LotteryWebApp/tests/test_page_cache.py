@@ -0,0 +1,30 @@
+# IMPORTS
+import pytest
+from sqlalchemy import text
+
+import page_cache
+from extensions import db
+from models import TableVersion
+
+
+# FUNCTIONS
+def versions():
+    return dict(db.session.query(TableVersion.table_name, TableVersion.version).all())
+
+
+# TESTS
+def test_writes_bump_only_cached_tables(app):
+    with app.app_context():
+        db.session.execute(text("INSERT INTO draws (user_id, numbers, been_played, matches_master, match_count, "
+                                "master_draw, lottery_round) VALUES (1, 'numbers', 0, 0, 0, 0, 0)"))
+        db.session.execute(text("INSERT INTO jobs (kind, lottery_round, status, draws_total, draws_processed, "
+                                "winners, created_on) VALUES ('settlement', 1, 'queued', 0, 0, 0, '2026-01-01')"))
+        db.session.commit()
+
+        assert versions() == {'draws': 1}
+
+
+def test_untracked_table_is_refused(app):
+    with app.app_context():
+        with pytest.raises(ValueError):
+            page_cache.table_versions(('jobs',))
@@ -0,0 +1,81 @@
+# Checks that the queries of the lottery and admin views use the index meant for them instead of scanning the draws
+# or users tables
+# IMPORTS
+import re
+
+import pytest
+
+from extensions import db
+from models import User, Draw, Settlement
+from pagination import DEFAULT_PAGE_SIZE, keyset_query
+
+# CONFIG
+# full scans of these tables fail the check
+CHECKED_TABLES = ('draws', 'users')
+
+# index each query searches, by query name
+EXPECTED_INDEXES = {
+    # admin/views.py
+    'create_winning_draw': 'ix_draws_master_draw_been_played',
+    'view_winning_draw': 'ix_draws_master_draw_been_played',
+    'view_all_users': 'ix_users_role',
+
+    # admin/settlement.py
+    'settlement_last_draw': 'ix_draws_master_draw_been_played',
+    'settlement_batch_last_id': 'ix_draws_master_draw_been_played',
+    'settlement_batch': 'ix_draws_master_draw_been_played',
+    'settlement_players': 'ix_draws_master_draw_been_played_lottery_round',
+    'round_results': 'ix_draws_lottery_round_matches_master',
+
+    # lottery/views.py
+    'view_draws': 'ix_draws_been_played_user_id',
+    'check_draws': 'ix_draws_been_played_user_id',
+
+    # lottery/archive.py (archive job)
+    'played_rounds': 'ix_draws_master_draw_been_played_lottery_round',
+    'played_draws': 'ix_draws_master_draw_been_played_lottery_round',
+}
+
+
+# FUNCTIONS
+# the queries run by the views, by name, built by the functions the views and the settlement call
+def view_queries():
+    from admin import settlement, views as admin_views
+    from lottery import archive, views as lottery_views
+
+    # a settlement of round 1 part way through its draws
+    in_progress = Settlement(lottery_round=1, last_draw_id=200000)
+    in_progress.checkpoint = 100000
+    batch_size = 100000
+
+    return {
+        'create_winning_draw': admin_views.winning_draw_query(),
+        'view_winning_draw': admin_views.unplayed_winning_draw_query(),
+        'view_all_users': keyset_query(admin_views.users_query(), User.id, 1, DEFAULT_PAGE_SIZE),
+        'settlement_last_draw': settlement.last_unplayed_draw_query(),
+        'settlement_batch_last_id': settlement.batch_last_id_query(in_progress, batch_size),
+        'settlement_batch': settlement.batch_query(in_progress, in_progress.checkpoint + batch_size),
+        'settlement_players': settlement.players_query(1),
+        'round_results': settlement.round_winners_query(1),
+        'view_draws': keyset_query(lottery_views.user_draws_query(1, False), Draw.id, 1, DEFAULT_PAGE_SIZE),
+        'check_draws': keyset_query(lottery_views.user_draws_query(1, True), Draw.id, 1, DEFAULT_PAGE_SIZE),
+        'played_rounds': archive.played_rounds_query(),
+        'played_draws': archive.played_draws_query(1),
+    }
+
+
+# EXPLAIN QUERY PLAN of a query, one line per step
+def query_plan(query):
+    sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    return [row[-1] for row in db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql))]
+
+
+# TESTS
+@pytest.mark.parametrize('name', EXPECTED_INDEXES)
+def test_query_uses_index(app, name):
+    with app.app_context():
+        plan = query_plan(view_queries()[name])
+
+    scans = [step for step in plan if re.match(r'^SCAN (%s)\b' % '|'.join(CHECKED_TABLES), step)]
+    assert not scans, plan
+    assert any(re.search(r'\bINDEX %s\b' % EXPECTED_INDEXES[name], step) for step in plan), plan
@@ -0,0 +1,24 @@
+# IMPORTS
+import logging
+
+import pytest
+
+from app import SecurityFilter
+
+
+# FUNCTIONS
+def record(message, *args):
+    return logging.LogRecord('root', logging.WARNING, __file__, 1, message, args, None)
+
+
+# TESTS
+@pytest.mark.parametrize('message', ['User Registration [%s, %s]', 'Login Failed (Exceeded login attempts) [%s, %s]',
+                                     'Login failed, 2FA Token Invalid [%s, %s]', 'Log In! [%s, %s]',
+                                     'Warning! Log Out! [%s, %s]', 'SECURITY - Unauthorised access attempt [%s, %s]',
+                                     'Security check failed [%s, %s]'])
+def test_security_events_are_kept(message):
+    assert SecurityFilter().filter(record(message, 'user@email.com', '127.0.0.1'))
+
+
+def test_other_records_are_dropped():
+    assert not SecurityFilter().filter(record('Background job %s failed', 1))
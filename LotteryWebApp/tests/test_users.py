@@ -0,0 +1,29 @@
+# IMPORTS
+from models import User
+
+# CONFIG
+BASE_URL = 'https://localhost'
+REGISTRATION = {'email': 'new@email.com', 'firstname': 'New', 'lastname': 'User', 'phone': '123-456-7890',
+                'password': 'Secret@123', 'confirm_password': 'Secret@123', 'pin_key': 'A' * 32}
+
+
+# TESTS
+def test_register_creates_user(app, client):
+    response = client.post('/register', base_url=BASE_URL, data=REGISTRATION)
+
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/login')
+    with app.app_context():
+        user = User.query.filter_by(email='new@email.com').one()
+        assert user.role == 'user'
+        assert user.pin_key == 'A' * 32
+
+
+def test_register_refuses_existing_email(app, client):
+    client.post('/register', base_url=BASE_URL, data=REGISTRATION)
+    response = client.post('/register', base_url=BASE_URL, data=REGISTRATION)
+
+    assert response.status_code == 200
+    assert b'Email address already exists!' in response.data
+    with app.app_context():
+        assert User.query.filter_by(email='new@email.com').count() == 1
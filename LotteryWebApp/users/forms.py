@@ -31,11 +31,6 @@ class RegisterForm(FlaskForm):
 # password_hash = bcrypt.hashpw(RegisterForm.password.encode('utf-8'), bcrypt.gensalt())
 
 class LoginForm(FlaskForm):
-
-    def __init__(self, formdata=_Auto, **kwargs):
-        super().__init__(formdata, kwargs)
-        self.email = None
-
     username = StringField(validators=[DataRequired(), Email()])
     password = PasswordField(validators=[DataRequired()])
     pin = IntegerField(validators=[DataRequired()])
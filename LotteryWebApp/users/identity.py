@@ -0,0 +1,109 @@
+# Cache of the users loaded by the Flask-Login user_loader, so authenticated page views do not query the users
+# table on every request. Entries expire after a TTL and are invalidated once an update of the user is committed.
+# The cache is per process, other workers see changes once their entries expire.
+# IMPORTS
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from extensions import db
+from models import User
+
+
+# CLASSES
+class IdentityCache:
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # the user with user_id attached to the current session, loaded from the users table on a miss
+    def get(self, user_id):
+        now = time.monotonic()
+
+        with self.lock:
+            cached = self.users.get(user_id)
+            if cached and cached[1] > now:
+                self.users.move_to_end(user_id)
+                self.hits += 1
+            else:
+                cached = None
+                self.misses += 1
+
+        # the cached user is detached, merging it without loading attaches a copy to this request's session without
+        # a query (deferred columns such as draw_key are still loaded when they are used)
+        if cached:
+            return db.session.merge(cached[0], load=False)
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+
+        # cache a detached copy and keep using the loaded user in this request
+        db.session.expunge(user)
+        with self.lock:
+            self.users[user_id] = (user, now + self.ttl)
+            self.users.move_to_end(user_id)
+            while len(self.users) > self.maxsize:
+                self.users.popitem(last=False)
+
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            if self.users.pop(user_id, None):
+                self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.users),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'invalidations': self.invalidations}
+
+
+# FUNCTIONS
+# the identity cache of an app, created from its config on first use
+def identity_cache(app):
+    if 'identity_cache' not in app.extensions:
+        app.extensions['identity_cache'] = IdentityCache(app.config['IDENTITY_CACHE_TTL'],
+                                                         app.config['IDENTITY_CACHE_SIZE'])
+    return app.extensions['identity_cache']
+
+
+# user_loader for Flask-Login
+def load_user(app, user_id):
+    return identity_cache(app).get(int(user_id))
+
+
+# note the users updated through the ORM (e.g. a role change) in their session. They are dropped from the cache of
+# the current app once the update is committed, so a request loading the user before the commit cannot cache the
+# old row for the TTL.
+def user_updated(mapper, connection, target):
+    object_session(target).info.setdefault('updated_users', set()).add(target.id)
+
+
+def session_committed(session):
+    for user_id in session.info.pop('updated_users', ()):
+        identity_cache(current_app).invalidate(user_id)
+
+
+def session_rolled_back(session):
+    session.info.pop('updated_users', None)
+
+
+# listen for user updates and commits, once however many apps are created
+def register_invalidation():
+    if not event.contains(User, 'after_update', user_updated):
+        event.listen(User, 'after_update', user_updated)
+        event.listen(Session, 'after_commit', session_committed)
+        event.listen(Session, 'after_rollback', session_rolled_back)
@@ -0,0 +1,148 @@
+# Token bucket throttling of login attempts, keyed by client IP and by account email. Buckets live in a pluggable
+# store: MemoryStore for a single process, SQLiteStore to share them between the workers on one host.
+# IMPORTS
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# CONFIG
+# expired buckets evicted per update, evicting a few at a time keeps eviction amortised O(1)
+EVICTIONS_PER_TAKE = 2
+
+
+# FUNCTIONS
+# tokens in a bucket after refilling it since it was last updated
+def refill(tokens, updated, capacity, refill_rate, now):
+    return min(capacity, tokens + (now - updated) * refill_rate)
+
+
+# time at which a bucket updated at now is full again, and can be forgotten
+def expiry(capacity, refill_rate, now):
+    return now + capacity / refill_rate
+
+
+# CLASSES
+# buckets in a dict ordered by last update, so the buckets expiring first are at the front
+class MemoryStore:
+
+    def __init__(self):
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    # take a token from the bucket of key, returns False if it is empty
+    def take(self, key, capacity, refill_rate, now):
+        with self.lock:
+            tokens, updated, _ = self.buckets.pop(key, (capacity, now, now))
+            tokens = refill(tokens, updated, capacity, refill_rate, now)
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            self.buckets[key] = (tokens, now, expiry(capacity, refill_rate, now))
+            self.evict(now)
+            return allowed
+
+    def evict(self, now):
+        for _ in range(EVICTIONS_PER_TAKE):
+            key, (_, _, expires) = next(iter(self.buckets.items()))
+            if expires > now:
+                return
+            del self.buckets[key]
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+# buckets in a SQLite database file shared by every worker process, indexed by expiry for eviction
+class SQLiteStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+        with self.connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS buckets '
+                               '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, '
+                               'expires REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_buckets_expires ON buckets (expires)')
+
+    # one connection per thread
+    def connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self.local.connection.execute('PRAGMA journal_mode = WAL')
+        return self.local.connection
+
+    # take a token from the bucket of key, returns False if it is empty
+    def take(self, key, capacity, refill_rate, now):
+        connection = self.connection()
+
+        # the write lock is taken up front so concurrent workers cannot both take the last token
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = refill(*row, capacity, refill_rate, now) if row else capacity
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            connection.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated, expires) VALUES (?, ?, ?, ?)',
+                               (key, tokens, now, expiry(capacity, refill_rate, now)))
+            connection.execute('DELETE FROM buckets WHERE key IN '
+                               '(SELECT key FROM buckets WHERE expires <= ? ORDER BY expires LIMIT ?)',
+                               (now, EVICTIONS_PER_TAKE))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+        return allowed
+
+    def __len__(self):
+        return self.connection().execute('SELECT COUNT(*) FROM buckets').fetchone()[0]
+
+
+# login attempts allowed per client IP and per account email. Every attempt takes a token from both buckets, which
+# refill at the given rate (tokens per second) up to their capacity.
+class LoginThrottle:
+
+    def __init__(self, store, ip_capacity, ip_refill_rate, email_capacity, email_refill_rate):
+        self.store = store
+        self.ip_capacity = ip_capacity
+        self.ip_refill_rate = ip_refill_rate
+        self.email_capacity = email_capacity
+        self.email_refill_rate = email_refill_rate
+
+    # returns False if the attempt is throttled
+    def allow(self, ip, email):
+        now = time.time()
+        ip_allowed = self.store.take('ip:%s' % ip, self.ip_capacity, self.ip_refill_rate, now)
+
+        # attempts throttled by IP do not use up the attempts of the account they target
+        if not ip_allowed:
+            return False
+
+        if email:
+            return self.store.take('email:%s' % email.strip().lower(), self.email_capacity,
+                                   self.email_refill_rate, now)
+        return True
+
+
+# the login throttle of an app, created from its config on first use
+def login_throttle(app):
+    if 'login_throttle' not in app.extensions:
+        if app.config['LOGIN_THROTTLE_STORE'] == 'sqlite':
+            store = SQLiteStore(app.config['LOGIN_THROTTLE_DATABASE'])
+        else:
+            store = MemoryStore()
+
+        app.extensions['login_throttle'] = LoginThrottle(store,
+                                                         app.config['LOGIN_THROTTLE_IP_CAPACITY'],
+                                                         app.config['LOGIN_THROTTLE_IP_RATE'],
+                                                         app.config['LOGIN_THROTTLE_EMAIL_CAPACITY'],
+                                                         app.config['LOGIN_THROTTLE_EMAIL_RATE'])
+
+    return app.extensions['login_throttle']
@@ -2,15 +2,17 @@
 import logging
 from datetime import datetime
 
-import pyotp
-from flask import Blueprint, render_template, flash, redirect, url_for, request, logging, session
+from flask import Blueprint, render_template, flash, redirect, url_for, request, current_app
 from flask_login import login_required, current_user, login_user, logout_user
 from werkzeug.security import check_password_hash
 
-from app import db, requires_roles
+from app import requires_roles
+from extensions import db
 from models import User
+from page_cache import render_cached
 from users import forms
 from users.forms import RegisterForm
+from users.throttle import login_throttle
 
 # CONFIG
 users_blueprint = Blueprint('users', __name__, template_folder='templates')
@@ -39,7 +41,7 @@ def register():
                         lastname=form.lastname.data,
                         phone=form.phone.data,
                         password=form.password.data,
-                        pin_key=form.pin_key,
+                        pin_key=form.pin_key.data,
                         role='user')
 
         # add the new user to the database
@@ -60,48 +62,40 @@ def login():
     global user
     form = forms.LoginForm()
 
-    # if session attribute logins do not exist, create attribute logins
-    if not session.get('logins'):
-        session['logins'] = 0
-
-    # if login attempts is 3 or more, generate error message
-    elif session.get('logins') >= 3:
-        flash("Incorrect Logins exceeded")
-        logging.warning("Login Failed (Exceeded login attempts) [%s, %s]", form.email.data, request.remote_addr)
+    # throttle login attempts by client IP and account email, before any database lookup or password check
+    if request.method == 'POST' and not login_throttle(current_app).allow(request.remote_addr,
+                                                                          request.form.get('username')):
+        flash("Too many login attempts, try again later")
+        logging.warning("Login Failed (Too many login attempts) [%s, %s]", request.form.get('username'),
+                        request.remote_addr)
+        return render_template('login.html', form=form), 429
 
     if form.validate_on_submit():
-        # increasing login attempt everytime submit is pressed
-        session['logins'] += 1
-
-        user = User.query.filter_by(email=form.email.data).first()
+        user = User.query.filter_by(email=form.username.data).first()
 
     # Checking credentials
 
         if not user or not check_password_hash(user.password, form.password.data):
-            # if no match create appropriate error message based on login attempts
-            if session['logins'] == 3:
-                flash('Login failed, No more attempts left')
-            elif session['logins'] == 2:
-                flash('Incorrect login details, try again. 1 login attempt left')
-            else:
-                flash('Incorrect login details, try again. 2 login attempts left')
+            flash('Incorrect login details, try again.')
 
-            logging.warning('Login Failed (Exceeded login attempts) [%s, %s]', form.email.data, request.remote_addr)
+            logging.warning('Login Failed (Exceeded login attempts) [%s, %s]', form.username.data, request.remote_addr)
 
             return render_template('login.html', form=form)
 
-        if not pyotp.TOTP(user.pin_key).verify(form.pin):
+        # pyotp is only needed once a password checks out, so it is not imported with the app
+        import pyotp
+
+        # the pin is read as an integer, which drops the leading zeros of the 6 digit token
+        if not pyotp.TOTP(user.pin_key).verify('%06d' % form.pin.data):
             flash("Invalid 2FA Token", "Danger!")
-            logging.warning('Login failed, 2FA Token Invalid [%s, %s]', form.email.data, request.remote_addr)
+            logging.warning('Login failed, 2FA Token Invalid [%s, %s]', form.username.data, request.remote_addr)
             return render_template('login.html', form=form)
 
-        # Resetting login attempts to 0
-        session['logins'] = 0
-
         login_user(user)
 
         user.last_logged_in = user.current_logged_in
         user.current_logged_in = datetime.now()
+        # committing the login times drops the user from the identity cache, the next request loads it afresh
         db.session.add(user)
         db.session.commit()
 
@@ -134,9 +128,9 @@ def profile():
 @users_blueprint.route('/account')
 @login_required
 def account():
-    return render_template('account.html',
-                           acc_no=current_user.id,
-                           email=current_user.email,
-                           firstname=current_user.firstname,
-                           lastname=current_user.lastname,
-                           phone=current_user.phone)
+    return render_cached('account.html', tables=('users',),
+                         acc_no=current_user.id,
+                         email=current_user.email,
+                         firstname=current_user.firstname,
+                         lastname=current_user.lastname,
+                         phone=current_user.phone)